@@ -2,29 +2,106 @@
 配置文件读取和变量定义模块
 """
 import os
+import logging
 import configparser
 
+from dotenv import load_dotenv
+
 # 项目根目录
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 CONFIG_PATH = os.path.join(BASE_DIR, 'config.ini')
 
-# 读取配置文件
+# 先加载 .env，使环境变量在读取配置之前生效
+load_dotenv(os.path.join(BASE_DIR, '.env'))
+
+# 读取配置文件，仅在导入时解析一次并转换为普通字典
 config = configparser.ConfigParser()
 config.read(CONFIG_PATH)
+_BOT_CONFIG = dict(config['BOT']) if config.has_section('BOT') else {}
+
+def _get(key, default=None, env_key=None):
+    """
+    读取配置项，环境变量优先于配置文件
+    
+    Args:
+        key: 配置项名称
+        default: 未配置时的默认值
+        env_key: 环境变量名称，默认与配置项同名
+        
+    Returns:
+        str: 配置值，未配置时返回默认值
+    """
+    value = os.getenv(env_key or key)
+    if value is None:
+        value = _BOT_CONFIG.get(key.lower(), default)
+    return value
+
+def _get_int(key, default, env_key=None):
+    """
+    读取整数配置项，格式错误时使用默认值
+    
+    Args:
+        key: 配置项名称
+        default: 默认值
+        env_key: 环境变量名称，默认与配置项同名
+        
+    Returns:
+        int: 配置值
+    """
+    value = _get(key, default, env_key)
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        logging.getLogger(__name__).error(f"{key}格式不正确，使用默认值 {default}: {value}")
+        return default
+
+def _get_bool(key, default):
+    """
+    读取布尔配置项
+    
+    Args:
+        key: 配置项名称
+        default: 默认值
+        
+    Returns:
+        bool: 配置值
+    """
+    value = _get(key)
+    if value is None:
+        return default
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'on')
+
+def _parse_owner_id(value):
+    """
+    将所有者ID解析为整数，便于后续直接比较
+    
+    Args:
+        value: 配置中的原始值
+        
+    Returns:
+        int 或 None: 解析后的所有者ID，未设置或格式错误时为 None
+    """
+    if not value:
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        logging.getLogger(__name__).error(f"OWNER_ID格式不正确，无法转换为整数: {value}")
+        return None
 
 # 从环境变量或配置文件获取配置
-TOKEN = os.getenv('TOKEN', config.get('BOT', 'TOKEN'))
-CHANNEL_ID = os.getenv('CHANNEL_ID', config.get('BOT', 'CHANNEL_ID'))
-DB_PATH = config.get('BOT', 'DB_PATH', fallback='submissions.db')
-TIMEOUT = config.getint('BOT', 'TIMEOUT', fallback=300)    # 会话超时时间（秒）
-ALLOWED_TAGS = config.getint('BOT', 'ALLOWED_TAGS', fallback=10)
+TOKEN = _get('TOKEN')
+CHANNEL_ID = _get('CHANNEL_ID')
+DB_PATH = _get('DB_PATH', 'submissions.db')
+TIMEOUT = _get_int('TIMEOUT', 300, env_key='SESSION_TIMEOUT')    # 会话超时时间（秒）
+ALLOWED_TAGS = _get_int('ALLOWED_TAGS', 10)
 NET_TIMEOUT = 120   # 网络请求超时时间（秒）
-OWNER_ID = config.get('BOT', 'OWNER_ID', fallback=None)  # 机器人所有者ID
-SHOW_SUBMITTER = config.getboolean('BOT', 'SHOW_SUBMITTER', fallback=True)  # 是否显示投稿人信息
-NOTIFY_OWNER = config.getboolean('BOT', 'NOTIFY_OWNER', fallback=True)  # 是否向所有者发送投稿通知
+OWNER_ID = _parse_owner_id(_get('OWNER_ID'))  # 机器人所有者ID（整数）
+SHOW_SUBMITTER = _get_bool('SHOW_SUBMITTER', True)  # 是否显示投稿人信息
+NOTIFY_OWNER = _get_bool('NOTIFY_OWNER', True)  # 是否向所有者发送投稿通知
 
 # 机器人模式: MEDIA (仅媒体), DOCUMENT (仅文档), MIXED (混合模式)
-BOT_MODE = config.get('BOT', 'BOT_MODE', fallback='MIXED')
+BOT_MODE = _get('BOT_MODE', 'MIXED').upper()
 
 # 模式常量定义
 MODE_MEDIA = 'MEDIA'      # 仅媒体上传
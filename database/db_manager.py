@@ -1,81 +1,358 @@
 """
 数据库管理模块
 """
+import asyncio
 import logging
-from datetime import datetime
+import sqlite3
+import time
 from contextlib import asynccontextmanager
+from typing import Optional, Set
 import aiosqlite
 
 from config.settings import DB_PATH, TIMEOUT
 
 logger = logging.getLogger(__name__)
 
+# 进程内共享的长连接，避免每次操作都重新打开数据库和创建工作线程
+_db_conn: Optional[aiosqlite.Connection] = None
+# 串行化对共享连接的使用，保证各自的事务互不干扰
+# 在事件循环中首次使用时才创建，Python 3.9 的 Lock 会绑定创建时的事件循环
+_db_lock: Optional[asyncio.Lock] = None
+
+# 连接级 PRAGMA 设置，仅在建立共享连接时执行一次
+# WAL + synchronous=NORMAL 避免每次提交都 fsync，其余项减少磁盘 I/O
+# foreign_keys 让删除会话时由 ON DELETE CASCADE 一并删除其媒体行
+_CONNECTION_PRAGMAS = (
+    "PRAGMA foreign_keys=ON",
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-64000",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA busy_timeout=5000",
+)
+
+# sqlite3 语句缓存大小（按 SQL 文本缓存已编译语句，默认 128）
+_CACHED_STATEMENTS = 256
+
+# 各处复用的 SQL 语句，保持文本一致以命中语句缓存
+SQL_DELETE_SUBMISSION = "DELETE FROM submissions WHERE user_id=?"
+SQL_UPSERT_SUBMISSION = ("INSERT OR REPLACE INTO submissions (user_id, timestamp, mode, username) "
+                         "VALUES (?, ?, ?, ?)")
+SQL_SELECT_MODE = "SELECT mode FROM submissions WHERE user_id=?"
+SQL_SELECT_SESSION = "SELECT user_id, mode, username FROM submissions WHERE user_id=?"
+SQL_UPDATE_MODE = "UPDATE submissions SET mode=? WHERE user_id=?"
+SQL_TOUCH_SUBMISSION = "UPDATE submissions SET timestamp=? WHERE user_id=?"
+SQL_CLEANUP_EXPIRED = "DELETE FROM submissions WHERE timestamp < ?"
+
+# 媒体和文档按上传顺序逐条追加到 submission_media（文档的 kind 为 document），避免整列读写 JSON
+# 删除或替换 submissions 中的会话时，媒体行由外键级联删除
+SQL_DELETE_MEDIA = "DELETE FROM submission_media WHERE user_id=?"
+SQL_INSERT_MEDIA = ("INSERT INTO submission_media (user_id, seq, kind, file_id) "
+                    "SELECT ?, COALESCE(MAX(seq), 0) + 1, ?, ? FROM submission_media WHERE user_id=?")
+SQL_SELECT_MEDIA = "SELECT kind, file_id FROM submission_media WHERE user_id=? ORDER BY seq"
+SQL_COUNT_MEDIA = "SELECT COUNT(*) FROM submission_media WHERE user_id=? AND kind<>'document'"
+SQL_COUNT_DOCUMENTS = "SELECT COUNT(*) FROM submission_media WHERE user_id=? AND kind='document'"
+
+# SQLite 3.35+ 支持 RETURNING，刷新时间戳的同一条语句即可取回文件数量
+_HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+_SQL_TOUCH_COUNT_MEDIA = f"{SQL_TOUCH_SUBMISSION} RETURNING ({SQL_COUNT_MEDIA})"
+_SQL_TOUCH_COUNT_DOCUMENTS = f"{SQL_TOUCH_SUBMISSION} RETURNING ({SQL_COUNT_DOCUMENTS})"
+_SQL_POP_SESSION = f"{SQL_DELETE_SUBMISSION} RETURNING user_id, mode, username"
+
+# 数据库结构版本，修改表结构时递增
+SCHEMA_VERSION = 1
+
+# submissions 表中后续版本新增的列，旧数据库启动时自动补齐
+_SUBMISSION_COLUMNS = {
+    "mode": "TEXT",
+    "tags": "TEXT",
+    "link": "TEXT",
+    "title": "TEXT",
+    "note": "TEXT",
+    "spoiler": "TEXT",
+    "username": "TEXT",
+}
+
+# 待删除的会话（如 /cancel），延迟合并为一次批量 DELETE
+_pending_deletes: Set[int] = set()
+_flush_task: Optional[asyncio.Task] = None
+_FLUSH_DELAY = 0.5          # 批量删除的合并窗口（秒）
+_SQLITE_MAX_PARAMS = 999    # SQLite 单条语句的参数上限
+
+# 文本步骤刷新会话时间戳的最短间隔（秒），小于超时时间以保证活跃会话不会被清理
+SESSION_TOUCH_INTERVAL = max(TIMEOUT / 3, 1)
+
+# 处理器中按需触发的过期清理最少间隔，定期任务之外避免每条消息都扫描一次
+_CLEANUP_MIN_INTERVAL = 60
+_last_cleanup = 0.0
+
+async def _get_connection() -> aiosqlite.Connection:
+    """
+    获取共享数据库连接，首次调用时建立连接
+    
+    Returns:
+        aiosqlite.Connection: 数据库连接对象
+    """
+    global _db_conn
+    if _db_conn is None:
+        conn = await aiosqlite.connect(DB_PATH, cached_statements=_CACHED_STATEMENTS)
+        conn.row_factory = aiosqlite.Row
+        for pragma in _CONNECTION_PRAGMAS:
+            await conn.execute(pragma)
+        await conn.commit()
+        _db_conn = conn
+        logger.info(f"已建立数据库连接: {DB_PATH}")
+    return _db_conn
+
+def _get_lock() -> asyncio.Lock:
+    """
+    获取共享连接的锁，首次调用时在当前事件循环中创建
+    
+    Returns:
+        asyncio.Lock: 共享连接的锁
+    """
+    global _db_lock
+    if _db_lock is None:
+        _db_lock = asyncio.Lock()
+    return _db_lock
+
 @asynccontextmanager
 async def get_db():
     """
     数据库连接上下文管理器
     
+    复用共享连接，退出时提交事务，出错时回滚。
+    注意：在上下文中不要执行网络请求等耗时操作，以免长时间占用连接。
+    
     Yields:
         aiosqlite.Connection: 数据库连接对象
     """
-    conn = await aiosqlite.connect(DB_PATH)
-    conn.row_factory = aiosqlite.Row
+    async with _get_lock():
+        conn = await _get_connection()
+        try:
+            yield conn
+            await conn.commit()
+        except BaseException:
+            # 任务被取消时（CancelledError 不属于 Exception）同样回滚，
+            # 避免半完成的事务留在共享连接上，被下一个使用者一并提交
+            await conn.rollback()
+            raise
+
+async def _delete_pending(conn: aiosqlite.Connection):
+    """
+    在当前事务中批量删除待删除的会话，调用方需持有 _db_lock
+    
+    Args:
+        conn: 数据库连接对象
+    """
+    if not _pending_deletes:
+        return
+    batch = list(_pending_deletes)
+    _pending_deletes.clear()
+    for start in range(0, len(batch), _SQLITE_MAX_PARAMS):
+        chunk = batch[start:start + _SQLITE_MAX_PARAMS]
+        placeholders = ",".join("?" * len(chunk))
+        await conn.execute(f"DELETE FROM submissions WHERE user_id IN ({placeholders})", chunk)
+    logger.info(f"已批量删除 {len(batch)} 条会话数据")
+
+async def touch_and_count(conn: aiosqlite.Connection, user_id: int, documents: bool = False) -> Optional[int]:
+    """
+    刷新会话时间戳并统计已上传的文件数量，需在 get_db() 上下文中调用
+    
+    Args:
+        conn: 数据库连接对象
+        user_id: 用户ID
+        documents: True 统计文档，False 统计媒体
+        
+    Returns:
+        Optional[int]: 文件数量；会话记录不存在时返回 None
+    """
+    now = time.time()
+    if _HAS_RETURNING:
+        sql = _SQL_TOUCH_COUNT_DOCUMENTS if documents else _SQL_TOUCH_COUNT_MEDIA
+        async with conn.execute(sql, (now, user_id, user_id)) as cursor:
+            row = await cursor.fetchone()
+        return row[0] if row else None
+    
+    async with conn.execute(SQL_TOUCH_SUBMISSION, (now, user_id)) as cursor:
+        if cursor.rowcount <= 0:
+            return None
+    async with conn.execute(SQL_COUNT_DOCUMENTS if documents else SQL_COUNT_MEDIA, (user_id,)) as cursor:
+        return (await cursor.fetchone())[0]
+
+async def pop_session(conn: aiosqlite.Connection, user_id: int) -> Optional[aiosqlite.Row]:
+    """
+    取出并删除会话记录，需在 get_db() 上下文中调用
+    
+    会话的媒体行会随之级联删除，调用方需在此之前读取媒体。
+    
+    Args:
+        conn: 数据库连接对象
+        user_id: 用户ID
+        
+    Returns:
+        Optional[aiosqlite.Row]: 会话记录 (user_id, mode, username)；不存在时返回 None
+    """
+    if _HAS_RETURNING:
+        async with conn.execute(_SQL_POP_SESSION, (user_id,)) as cursor:
+            return await cursor.fetchone()
+    
+    async with conn.execute(SQL_SELECT_SESSION, (user_id,)) as cursor:
+        row = await cursor.fetchone()
+    if row:
+        await conn.execute(SQL_DELETE_SUBMISSION, (user_id,))
+    return row
+
+async def flush_pending_deletes():
+    """
+    立即执行所有排队中的会话删除
+    """
     try:
-        yield conn
-        await conn.commit()
+        async with get_db() as conn:
+            await _delete_pending(conn)
     except Exception as e:
-        await conn.rollback()
-        raise e
+        logger.error(f"批量删除会话数据失败: {e}")
+
+async def _flush_later():
+    """
+    等待合并窗口结束后执行批量删除
+    """
+    global _flush_task
+    try:
+        await asyncio.sleep(_FLUSH_DELAY)
     finally:
-        await conn.close()
+        _flush_task = None
+    await flush_pending_deletes()
+
+def queue_submission_delete(user_id: int):
+    """
+    将用户会话加入批量删除队列，在合并窗口结束后统一删除
+    
+    Args:
+        user_id: 用户ID
+    """
+    global _flush_task
+    _pending_deletes.add(user_id)
+    if _flush_task is None:
+        _flush_task = asyncio.create_task(_flush_later())
+
+def discard_pending_delete(user_id: int):
+    """
+    取消用户排队中的会话删除（用户重新开始投稿时调用，需在 get_db() 内执行）
+    
+    Args:
+        user_id: 用户ID
+    """
+    _pending_deletes.discard(user_id)
+
+async def close_db():
+    """
+    关闭共享数据库连接
+    """
+    global _db_conn, _flush_task
+    if _flush_task is not None:
+        _flush_task.cancel()
+        _flush_task = None
+    if _db_conn is None:
+        return
+    async with _get_lock():
+        try:
+            # 关闭前写入尚未执行的批量删除
+            await _delete_pending(_db_conn)
+            await _db_conn.commit()
+        except Exception as e:
+            logger.error(f"关闭前批量删除会话数据失败: {e}")
+        await _db_conn.close()
+        _db_conn = None
+    logger.info("数据库连接已关闭")
+
+async def _create_schema(conn: aiosqlite.Connection):
+    """
+    创建或升级 submissions 表结构
+    
+    Args:
+        conn: 数据库连接对象
+    """
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS submissions (
+            user_id INTEGER PRIMARY KEY,
+            timestamp REAL,
+            mode TEXT,
+            tags TEXT,
+            link TEXT,
+            title TEXT,
+            note TEXT,
+            spoiler TEXT,
+            username TEXT
+        )
+    ''')
+    # 一次性补齐旧版本数据库缺失的列，与建表处于同一事务
+    async with conn.execute("PRAGMA table_info(submissions)") as cursor:
+        existing = {row["name"] for row in await cursor.fetchall()}
+    for column, column_type in _SUBMISSION_COLUMNS.items():
+        if column not in existing:
+            await conn.execute(f"ALTER TABLE submissions ADD COLUMN {column} {column_type}")
+            logger.info(f"已为 submissions 表添加缺失列: {column}")
+    # 过期清理按 timestamp 范围删除，建立索引避免全表扫描
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_submissions_ts ON submissions(timestamp)")
+    # 会话中的媒体和文档，每个文件一行，按 seq 保持上传顺序
+    # WITHOUT ROWID 使行直接按 (user_id, seq) 聚簇存储，省去 rowid 表之外的主键索引
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS submission_media (
+            user_id INTEGER NOT NULL,
+            seq INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            file_id TEXT NOT NULL,
+            PRIMARY KEY (user_id, seq),
+            FOREIGN KEY (user_id) REFERENCES submissions(user_id) ON DELETE CASCADE
+        ) WITHOUT ROWID
+    ''')
 
 async def init_db():
     """
     初始化数据库
+    
+    通过 PRAGMA user_version 记录结构版本，已是最新版本时跳过建表和迁移。
     """
     try:
         async with get_db() as conn:
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS submissions (
-                    user_id INTEGER PRIMARY KEY,
-                    timestamp REAL,
-                    mode TEXT,
-                    image_id TEXT,
-                    document_id TEXT,
-                    tags TEXT,
-                    link TEXT,
-                    title TEXT,
-                    note TEXT,
-                    spoiler TEXT,
-                    username TEXT
-                )
-            ''')
-            await conn.commit()
-            logger.info("数据库初始化完成")
+            async with conn.execute("PRAGMA user_version") as cursor:
+                version = (await cursor.fetchone())[0]
+            if version >= SCHEMA_VERSION:
+                logger.info(f"数据库结构已是最新版本 (v{version})，跳过初始化")
+                return
+            
+            await _create_schema(conn)
+            await conn.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+            logger.info(f"数据库初始化完成，结构版本: v{SCHEMA_VERSION}")
     except Exception as e:
         logger.error(f"初始化数据库时出错: {e}")
         raise
 
+def cleanup_due() -> bool:
+    """
+    距离上次过期清理是否已超过最小间隔
+    
+    Returns:
+        bool: 需要再次清理时返回 True
+    """
+    return time.monotonic() - _last_cleanup >= _CLEANUP_MIN_INTERVAL
+
 async def cleanup_old_data():
     """
     清理过期的会话数据
     """
+    global _last_cleanup
+    _last_cleanup = time.monotonic()
     try:
-        # 首先检查表是否存在
-        async with aiosqlite.connect(DB_PATH) as conn:
-            c = await conn.cursor()
-            await c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='submissions'")
-            table_exists = await c.fetchone()
-            
-        if not table_exists:
-            logger.warning("submissions 表不存在，跳过清理")
-            return
-            
-        # 如果表存在，执行清理
+        # 表由 init_db() 在启动时创建，这里直接执行清理
         async with get_db() as conn:
-            c = await conn.cursor()
-            cutoff = datetime.now().timestamp() - TIMEOUT
-            await c.execute("DELETE FROM submissions WHERE timestamp < ?", (cutoff,))
+            # 顺带执行排队中的会话删除，合并到同一个事务
+            await _delete_pending(conn)
+            # 时间戳最多滞后一个刷新间隔，清理时一并放宽，保证空闲满 TIMEOUT 才会过期
+            cutoff = time.time() - TIMEOUT - SESSION_TOUCH_INTERVAL
+            await conn.execute(SQL_CLEANUP_EXPIRED, (cutoff,))
             logger.info("已清理过期数据")
     except Exception as e:
-        logger.error(f"清理过期数据失败: {e}")
\ No newline at end of file
+        logger.error(f"清理过期数据失败: {e}")
@@ -9,20 +9,33 @@ from typing import Dict, List, Any
 from telegram import Update
 from telegram.ext import ConversationHandler, CallbackContext
 
-from database.db_manager import get_db
+from database.db_manager import queue_submission_delete
 from utils.blacklist import (
     is_owner, 
     add_to_blacklist, 
+    add_many_to_blacklist, 
     remove_from_blacklist, 
     get_blacklist, 
     is_blacklisted,
     _blacklist
 )
 from config.settings import OWNER_ID, NOTIFY_OWNER, TIMEOUT
+from utils.helper_functions import clear_submission
 from utils.database import get_user_state, get_all_user_states
 
 logger = logging.getLogger(__name__)
 
+# 回复消息模板
+MSG_CANCELED = "❌ 投稿已取消"
+MSG_NOT_OWNER = "⚠️ 只有机器人所有者才能使用此命令"
+MSG_COMMAND_ERROR = "❌ 处理命令时发生错误: {error}"
+MSG_BL_ADD_OK = "✅ 已将用户 {uid} 添加到黑名单\n原因: {reason}"
+MSG_BL_ADD_FAILED = "❌ 添加用户 {uid} 到黑名单时出错"
+MSG_BL_REMOVE_OK = "✅ 已将用户 {uid} 从黑名单中移除"
+MSG_BL_NOT_FOUND = "❓ 用户 {uid} 不在黑名单中"
+MSG_BL_EMPTY = "📋 黑名单为空"
+MSG_BL_IMPORT_FAILED = "❌ 批量导入黑名单时出错"
+
 async def cancel(update: Update, context: CallbackContext) -> int:
     """
     处理 /cancel 命令，取消当前会话
@@ -34,15 +47,12 @@ async def cancel(update: Update, context: CallbackContext) -> int:
     Returns:
         int: 结束会话状态
     """
-    logger.info(f"收到 /cancel 命令，user_id: {update.effective_user.id}")
+    logger.info("收到 /cancel 命令，user_id: %s", update.effective_user.id)
     user_id = update.effective_user.id
-    try:
-        async with get_db() as conn:
-            c = await conn.cursor()
-            await c.execute("DELETE FROM submissions WHERE user_id=?", (user_id,))
-    except Exception as e:
-        logger.error(f"取消时删除数据错误: {e}")
-    await update.message.reply_text("❌ 投稿已取消")
+    # 会话数据排队后批量删除，不在此处单独开事务
+    queue_submission_delete(user_id)
+    clear_submission(context)
+    await update.message.reply_text(MSG_CANCELED)
     return ConversationHandler.END
 
 async def debug(update: Update, context: CallbackContext):
@@ -84,7 +94,8 @@ async def debug(update: Update, context: CallbackContext):
         try:
             process = psutil.Process()
             memory_usage = process.memory_info().rss / 1024 / 1024  # MB
-            cpu_percent = process.cpu_percent(interval=0.1)
+            # cpu_percent 会阻塞采样 0.1 秒，放到线程中执行以免卡住事件循环
+            cpu_percent = await asyncio.to_thread(process.cpu_percent, interval=0.1)
             uptime = (datetime.now() - datetime.fromtimestamp(process.create_time())).total_seconds() / 60  # 分钟
             
             system_info = (
@@ -134,7 +145,7 @@ async def catch_all(update: Update, context: CallbackContext):
         update: Telegram 更新对象
         context: 回调上下文
     """
-    logger.debug(f"收到未知消息: {update}")
+    logger.debug("收到未知消息: %s", update)
 
 async def blacklist_add(update: Update, context: CallbackContext):
     """
@@ -154,14 +165,14 @@ async def blacklist_add(update: Update, context: CallbackContext):
     if not is_owner(user_id):
         logger.warning(f"非所有者用户 {user_id} 尝试使用黑名单添加命令")
         try:
-            await update.message.reply_text("⚠️ 只有机器人所有者才能使用此命令")
+            await update.message.reply_text(MSG_NOT_OWNER)
         except Exception as e:
             logger.error(f"发送权限拒绝消息失败: {e}")
         return
     
-    # 检查参数
-    args = context.args
-    if not args or len(args) < 1:
+    # 检查参数：直接切分原始消息，原因部分保留原有空白
+    parts = (update.message.text or "").split(None, 2)
+    if len(parts) < 2:
         try:
             await update.message.reply_text(
                 "⚠️ 命令格式错误\n\n"
@@ -174,20 +185,20 @@ async def blacklist_add(update: Update, context: CallbackContext):
         return
     
     try:
-        target_user_id = int(args[0])
-        reason = " ".join(args[1:]) if len(args) > 1 else "未指定原因"
+        target_user_id = int(parts[1])
+        reason = parts[2].strip() if len(parts) > 2 else "未指定原因"
         
         # 添加到黑名单
         success = await add_to_blacklist(target_user_id, reason)
         if success:
             try:
-                await update.message.reply_text(f"✅ 已将用户 {target_user_id} 添加到黑名单\n原因: {reason}")
+                await update.message.reply_text(MSG_BL_ADD_OK.format(uid=target_user_id, reason=reason))
                 logger.info(f"用户 {user_id} 成功将 {target_user_id} 添加到黑名单，原因: {reason}")
             except Exception as e:
                 logger.error(f"发送成功消息失败: {e}")
         else:
             try:
-                await update.message.reply_text(f"❌ 添加用户 {target_user_id} 到黑名单时出错")
+                await update.message.reply_text(MSG_BL_ADD_FAILED.format(uid=target_user_id))
             except Exception as e:
                 logger.error(f"发送失败消息失败: {e}")
     except ValueError:
@@ -202,10 +213,82 @@ async def blacklist_add(update: Update, context: CallbackContext):
     except Exception as e:
         logger.error(f"处理黑名单添加命令时出错: {e}", exc_info=True)
         try:
-            await update.message.reply_text(f"❌ 处理命令时发生错误: {str(e)[:100]}")
+            await update.message.reply_text(MSG_COMMAND_ERROR.format(error=str(e)[:100]))
         except Exception as e2:
             logger.error(f"发送错误消息失败: {e2}")
 
+async def blacklist_import(update: Update, context: CallbackContext):
+    """
+    批量导入黑名单
+    
+    命令格式: /blacklist_import 后每行一个用户: <user_id> [reason]
+    
+    Args:
+        update: Telegram 更新对象
+        context: 回调上下文
+    """
+    user_id = update.effective_user.id
+    
+    # 检查是否为所有者
+    if not is_owner(user_id):
+        logger.warning(f"非所有者用户 {user_id} 尝试使用黑名单导入命令")
+        try:
+            await update.message.reply_text(MSG_NOT_OWNER)
+        except Exception as e:
+            logger.error(f"发送权限拒绝消息失败: {e}")
+        return
+    
+    # 去掉命令本身，剩余内容每行一条记录
+    parts = (update.message.text or "").split(None, 1)
+    body = parts[1] if len(parts) > 1 else ""
+    
+    entries = []
+    invalid_lines = []
+    for line in body.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        fields = line.split(None, 1)
+        try:
+            entries.append((int(fields[0]), fields[1].strip() if len(fields) > 1 else "未指定原因"))
+        except ValueError:
+            invalid_lines.append(line)
+    
+    if not entries:
+        try:
+            await update.message.reply_text(
+                "⚠️ 命令格式错误\n\n"
+                "正确格式: /blacklist_import 后每行一个用户\n"
+                "<用户ID> [原因]\n\n"
+                "例如:\n"
+                "/blacklist_import\n"
+                "123456789 发送垃圾内容\n"
+                "987654321"
+            )
+        except Exception as e:
+            logger.error(f"发送格式提示消息失败: {e}")
+        return
+    
+    added = await add_many_to_blacklist(entries)
+    if added < 0:
+        try:
+            await update.message.reply_text(MSG_BL_IMPORT_FAILED)
+        except Exception as e:
+            logger.error(f"发送失败消息失败: {e}")
+        return
+    
+    lines = [f"✅ 已导入 {added} 个用户到黑名单"]
+    skipped = len(entries) - added
+    if skipped:
+        lines.append(f"跳过 {skipped} 个重复或已在黑名单中的用户")
+    if invalid_lines:
+        lines.append(f"忽略 {len(invalid_lines)} 行格式错误的记录")
+    try:
+        await update.message.reply_text("\n".join(lines))
+        logger.info(f"用户 {user_id} 批量导入黑名单，新增 {added} 个用户")
+    except Exception as e:
+        logger.error(f"发送成功消息失败: {e}")
+
 async def blacklist_remove(update: Update, context: CallbackContext):
     """
     从黑名单中移除用户
@@ -224,7 +307,7 @@ async def blacklist_remove(update: Update, context: CallbackContext):
     if not is_owner(user_id):
         logger.warning(f"非所有者用户 {user_id} 尝试使用黑名单移除命令")
         try:
-            await update.message.reply_text("⚠️ 只有机器人所有者才能使用此命令")
+            await update.message.reply_text(MSG_NOT_OWNER)
         except Exception as e:
             logger.error(f"发送权限拒绝消息失败: {e}")
         return
@@ -250,13 +333,13 @@ async def blacklist_remove(update: Update, context: CallbackContext):
         success = await remove_from_blacklist(target_user_id)
         if success:
             try:
-                await update.message.reply_text(f"✅ 已将用户 {target_user_id} 从黑名单中移除")
+                await update.message.reply_text(MSG_BL_REMOVE_OK.format(uid=target_user_id))
                 logger.info(f"用户 {user_id} 成功将 {target_user_id} 从黑名单中移除")
             except Exception as e:
                 logger.error(f"发送成功消息失败: {e}")
         else:
             try:
-                await update.message.reply_text(f"❓ 用户 {target_user_id} 不在黑名单中")
+                await update.message.reply_text(MSG_BL_NOT_FOUND.format(uid=target_user_id))
             except Exception as e:
                 logger.error(f"发送失败消息失败: {e}")
     except ValueError:
@@ -271,7 +354,7 @@ async def blacklist_remove(update: Update, context: CallbackContext):
     except Exception as e:
         logger.error(f"处理黑名单移除命令时出错: {e}", exc_info=True)
         try:
-            await update.message.reply_text(f"❌ 处理命令时发生错误: {str(e)[:100]}")
+            await update.message.reply_text(MSG_COMMAND_ERROR.format(error=str(e)[:100]))
         except Exception as e2:
             logger.error(f"发送错误消息失败: {e2}")
 
@@ -293,7 +376,7 @@ async def blacklist_list(update: Update, context: CallbackContext):
     if not is_owner(user_id):
         logger.warning(f"非所有者用户 {user_id} 尝试使用黑名单列表命令")
         try:
-            await update.message.reply_text("⚠️ 只有机器人所有者才能使用此命令")
+            await update.message.reply_text(MSG_NOT_OWNER)
         except Exception as e:
             logger.error(f"发送权限拒绝消息失败: {e}")
         return
@@ -304,18 +387,21 @@ async def blacklist_list(update: Update, context: CallbackContext):
         
         if not blacklist:
             try:
-                await update.message.reply_text("📋 黑名单为空")
+                await update.message.reply_text(MSG_BL_EMPTY)
                 logger.info("黑名单为空，返回空列表")
             except Exception as e:
                 logger.error(f"发送空黑名单消息失败: {e}")
             return
         
         # 格式化黑名单消息
-        message = "📋 **黑名单用户列表**:\n\n"
-        for i, user in enumerate(blacklist, 1):
-            message += f"{i}. ID: `{user['user_id']}`\n"
-            message += f"   原因: {user['reason']}\n"
-            message += f"   添加时间: {user['added_at']}\n\n"
+        parts = ["📋 **黑名单用户列表**:\n\n"]
+        parts.extend(
+            f"{i}. ID: `{user['user_id']}`\n"
+            f"   原因: {user['reason']}\n"
+            f"   添加时间: {user['added_at']}\n\n"
+            for i, user in enumerate(blacklist, 1)
+        )
+        message = "".join(parts)
         
         try:
             # 尝试带Markdown格式发送
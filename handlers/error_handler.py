@@ -3,6 +3,7 @@
 """
 import logging
 import asyncio
+import re
 import traceback
 import html
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
@@ -24,6 +25,12 @@ logger = logging.getLogger(__name__)
 # 最大重试次数
 MAX_RETRY_ATTEMPTS = 3
 
+# 一般错误回复附带的按钮，内容固定，模块加载时创建一次即可
+_ERROR_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("重试", callback_data="retry_last_action")],
+    [InlineKeyboardButton("重新开始", callback_data="restart")]
+])
+
 async def error_handler(update: Update, context: CallbackContext) -> None:
     """
     处理程序错误的全局处理函数
@@ -97,14 +104,13 @@ async def error_handler(update: Update, context: CallbackContext) -> None:
         except Exception as e:
             logger.error(f"发送错误通知失败: {e}")
     
-    # 记录详细的堆栈跟踪
-    tb_list = traceback.format_exception(None, error, error.__traceback__)
-    tb_string = ''.join(tb_list)
-    logger.error(f"完整的堆栈跟踪:\n{tb_string}")
+    # 记录详细的堆栈跟踪，交由 logging 在实际输出时再格式化
+    logger.error("完整的堆栈跟踪:", exc_info=error)
     
     # 可选：向开发者发送错误报告
     if False:  # 设置为True以启用向开发者发送错误报告
         # 安全地构建错误消息
+        tb_string = ''.join(traceback.format_exception(None, error, error.__traceback__))
         message = (
             f"发生异常\n"
             f"<pre>update = {html.escape(str(update) if isinstance(update, object) else 'No update')}"
@@ -125,32 +131,31 @@ async def handle_timeout_error(update, context):
         except Exception as e:
             logger.error(f"回复超时错误消息失败: {e}")
 
+# 常见 BadRequest 错误的匹配模式：(正则, 需回复的提示, 日志)，提示为 None 表示忽略
+_BAD_REQUEST_PATTERNS = [
+    (re.compile(r"message is not modified"), None, "忽略'消息未修改'错误"),
+    (re.compile(r"message to edit not found"), None, "忽略'未找到要编辑的消息'错误"),
+    (re.compile(r"query is too old"), "此操作已过期，请重新开始。", None),
+    (re.compile(r"have no rights|not enough rights"), "机器人权限不足，无法执行此操作。请联系管理员。", None),
+]
+_BAD_REQUEST_DEFAULT_REPLY = "⚠️ 请求格式错误，请检查输入并重试。"
+
 async def handle_bad_request(update, context, error):
     """处理错误请求"""
     if isinstance(update, Update) and update.effective_message:
         try:
             # 检查常见的 BadRequest 错误
             error_text = str(error).lower()
+            reply = _BAD_REQUEST_DEFAULT_REPLY
+            for pattern, pattern_reply, log_msg in _BAD_REQUEST_PATTERNS:
+                if pattern.search(error_text):
+                    reply = pattern_reply
+                    if log_msg:
+                        logger.info(log_msg)
+                    break
             
-            if "message is not modified" in error_text:
-                # 消息未修改，忽略即可
-                logger.info("忽略'消息未修改'错误")
-                return
-            elif "message to edit not found" in error_text:
-                logger.info("忽略'未找到要编辑的消息'错误")
-                return
-            elif "query is too old" in error_text:
-                await update.effective_message.reply_text(
-                    "此操作已过期，请重新开始。"
-                )
-            elif "have no rights" in error_text or "not enough rights" in error_text:
-                await update.effective_message.reply_text(
-                    "机器人权限不足，无法执行此操作。请联系管理员。"
-                )
-            else:
-                await update.effective_message.reply_text(
-                    "⚠️ 请求格式错误，请检查输入并重试。"
-                )
+            if reply:
+                await update.effective_message.reply_text(reply)
         except Exception as e:
             logger.error(f"回复 BadRequest 错误消息失败: {e}")
 
@@ -217,17 +222,10 @@ async def handle_general_error(update, context, error):
     """处理一般性错误"""
     if isinstance(update, Update) and update.effective_message:
         try:
-            # 创建错误报告按钮
-            keyboard = [
-                [InlineKeyboardButton("重试", callback_data="retry_last_action")],
-                [InlineKeyboardButton("重新开始", callback_data="restart")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
             await update.effective_message.reply_text(
                 "⚠️ 对话处理过程中发生错误，请稍后再试或重新开始。\n"
                 "如果问题持续出现，请联系管理员。",
-                reply_markup=reply_markup
+                reply_markup=_ERROR_KEYBOARD
             )
         except Exception as e:
             logger.error(f"回复一般错误消息失败: {e}")
@@ -1,18 +1,45 @@
 """
 媒体处理模块
 """
-import json
 import logging
-from datetime import datetime
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import ConversationHandler, CallbackContext
 
 from models.state import STATE
-from database.db_manager import get_db
-from utils.helper_functions import validate_state
+from database.db_manager import get_db, touch_and_count, SQL_UPDATE_MODE, SQL_INSERT_MEDIA, SQL_COUNT_MEDIA, SQL_DELETE_MEDIA
+from utils.helper_functions import validate_state, get_submission, get_session_mode
 
 logger = logging.getLogger(__name__)
 
+def _document_as(mime_check):
+    """
+    生成按 MIME 类型接收文档附件的提取函数
+    
+    Args:
+        mime_check: 判断 MIME 类型是否匹配的函数
+        
+    Returns:
+        提取 file_id 的函数，不匹配时返回 None
+    """
+    def extract(message):
+        document = message.document
+        if document and document.mime_type and mime_check(document.mime_type):
+            return document.file_id
+        return None
+    return extract
+
+# 可接收的媒体：(记录类型, 提取 file_id 的函数)，按顺序匹配第一个
+# animation 需排在 document 之前判断，GIF 消息会同时带有 document 字段
+_MEDIA_EXTRACTORS = (
+    ("photo", lambda m: m.photo[-1].file_id if m.photo else None),
+    ("video", lambda m: m.video.file_id if m.video else None),
+    ("animation", lambda m: m.animation.file_id if m.animation else None),
+    ("audio", lambda m: m.audio.file_id if m.audio else None),
+    # 以文件附件形式发送的 GIF 和音频同样按媒体接收
+    ("animation", _document_as(lambda mime: mime == "image/gif")),
+    ("audio", _document_as(lambda mime: mime.startswith("audio/"))),
+)
+
 @validate_state(STATE['MEDIA'])
 async def handle_media(update: Update, context: CallbackContext) -> int:
     """
@@ -25,71 +52,54 @@ async def handle_media(update: Update, context: CallbackContext) -> int:
     Returns:
         int: 当前会话状态
     """
-    logger.info(f"处理媒体输入，user_id: {update.effective_user.id}")
     user_id = update.effective_user.id
+    logger.info("处理媒体输入，user_id: %s", user_id)
     new_media = None
 
-    if update.message.photo:
-        file_id = update.message.photo[-1].file_id
-        new_media = f"photo:{file_id}"
-    elif update.message.video:
-        file_id = update.message.video.file_id
-        new_media = f"video:{file_id}"
-    elif update.message.animation:
-        file_id = update.message.animation.file_id
-        new_media = f"animation:{file_id}"
-    elif update.message.audio:
-        file_id = update.message.audio.file_id
-        new_media = f"audio:{file_id}"
-    elif update.message.document:
-        mime = update.message.document.mime_type
-        logger.info(f"收到文档，MIME类型: {mime}, 用户ID: {user_id}")
+    for kind, extract in _MEDIA_EXTRACTORS:
+        file_id = extract(update.message)
+        if file_id:
+            new_media = (kind, file_id)
+            break
+
+    if new_media is None and update.message.document:
+        logger.info("收到不支持的文档，MIME类型: %s, 用户ID: %s", update.message.document.mime_type, user_id)
+        
+        # 检查是否是媒体模式
+        mode = None
+        try:
+            mode = await get_session_mode(context, user_id)
+        except Exception as e:
+            logger.error("检查模式错误: %s", e, exc_info=True)
+        
+        logger.info("用户当前模式: %s, user_id: %s", mode, user_id)
         
-        if mime == "image/gif":
-            file_id = update.message.document.file_id
-            new_media = f"animation:{file_id}"
-        elif mime and mime.startswith("audio/"):
-            file_id = update.message.document.file_id
-            new_media = f"audio:{file_id}"
-        else:
-            # 检查是否是媒体模式
-            try:
-                async with get_db() as conn:
-                    c = await conn.cursor()
-                    await c.execute("SELECT mode FROM submissions WHERE user_id=?", (user_id,))
-                    row = await c.fetchone()
-                    mode = row["mode"] if row and "mode" in row.keys() else None
-                    
-                    logger.info(f"用户当前模式: {mode}, user_id: {user_id}")
-                    
-                    if row and mode == "media":
-                        logger.info(f"用户在媒体模式下发送了文件附件，user_id: {user_id}, 文件名: {update.message.document.file_name}")
-                        
-                        # 创建切换到文档模式的内联键盘
-                        keyboard = [
-                            [InlineKeyboardButton("切换到文档模式", callback_data="switch_to_doc")]
-                        ]
-                        reply_markup = InlineKeyboardMarkup(keyboard)
-                        
-                        await update.message.reply_text(
-                            "⚠️ 文件附件不能在媒体模式下上传。您可以：\n\n"
-                            "1️⃣ 点击下方按钮切换到文档模式\n"
-                            "2️⃣ 或发送 /cancel 取消当前投稿，然后发送 /start 重新选择文档模式",
-                            reply_markup=reply_markup
-                        )
-                        return STATE['MEDIA']
-            except Exception as e:
-                logger.error(f"检查模式错误: {e}", exc_info=True)
+        if mode == "media":
+            logger.info("用户在媒体模式下发送了文件附件，user_id: %s, 文件名: %s", user_id, update.message.document.file_name)
+            
+            # 创建切换到文档模式的内联键盘
+            keyboard = [
+                [InlineKeyboardButton("切换到文档模式", callback_data="switch_to_doc")]
+            ]
+            reply_markup = InlineKeyboardMarkup(keyboard)
             
-            # 默认提示
             await update.message.reply_text(
-                "⚠️ 不支持的文件类型，请发送支持的媒体\n\n"
-                "📱 请直接发送媒体（非文件附件形式）：\n"
-                "• 从相册选择后直接发送\n"
-                "• 直接发送视频/GIF"
+                "⚠️ 文件附件不能在媒体模式下上传。您可以：\n\n"
+                "1️⃣ 点击下方按钮切换到文档模式\n"
+                "2️⃣ 或发送 /cancel 取消当前投稿，然后发送 /start 重新选择文档模式",
+                reply_markup=reply_markup
             )
             return STATE['MEDIA']
-    else:
+        
+        # 默认提示
+        await update.message.reply_text(
+            "⚠️ 不支持的文件类型，请发送支持的媒体\n\n"
+            "📱 请直接发送媒体（非文件附件形式）：\n"
+            "• 从相册选择后直接发送\n"
+            "• 直接发送视频/GIF"
+        )
+        return STATE['MEDIA']
+    elif new_media is None:
         await update.message.reply_text(
             "⚠️ 请发送支持的媒体文件\n\n"
             "📱 支持的媒体格式：图片、视频、GIF、音频"
@@ -97,58 +107,49 @@ async def handle_media(update: Update, context: CallbackContext) -> int:
         return STATE['MEDIA']
 
     try:
+        # 模式在会话开始时已缓存，这里无需再查询数据库
+        mode = await get_session_mode(context, user_id) or "mixed"
         async with get_db() as conn:
-            c = await conn.cursor()
-            await c.execute("SELECT image_id, mode FROM submissions WHERE user_id=?", (user_id,))
-            row = await c.fetchone()
+            # 刷新时间戳的同时确认会话记录仍然存在，并取回当前媒体数量
+            media_count = await touch_and_count(conn, user_id)
+            alive = media_count is not None
             
-            if not row:
-                await update.message.reply_text("❌ 会话已过期，请重新发送 /start")
-                return ConversationHandler.END
-                
-            # 初始化媒体列表 - 确保即使数据库中为空值也能正确处理
-            media_list = []
-            try:
-                if row["image_id"]:
-                    media_list = json.loads(row["image_id"])
-            except (json.JSONDecodeError, TypeError):
-                # 如果解析失败，创建新的空列表
-                media_list = []
-                
-            # sqlite3.Row 对象不支持 get 方法
-            mode = row["mode"] if "mode" in row.keys() else "mixed"
-            mode = mode.lower() if mode else "mixed"
-            
-            # 根据模式设置不同的限制
-            media_limit = 50 if mode == "media" else 10
-            
-            # 限制媒体数量
-            if len(media_list) >= media_limit:
-                await update.message.reply_text(f"⚠️ 已达到媒体上传上限（{media_limit}个）")
-                return STATE['MEDIA']
-                
-            media_list.append(new_media)
-            await c.execute("UPDATE submissions SET image_id=?, timestamp=? WHERE user_id=?",
-                      (json.dumps(media_list), datetime.now().timestamp(), user_id))
-            
-            logger.info(f"当前媒体数量：{len(media_list)}")
-            
-            # 根据模式提供不同的提示
-            if mode == "media":
-                await update.message.reply_text(
-                    f"✅ 已接收媒体，共计 {len(media_list)} 个。\n"
-                    f"继续发送媒体文件，或发送 /done_media 完成上传。"
-                )
-            else:
-                await update.message.reply_text(
-                    f"✅ 已接收媒体，共计 {len(media_list)} 个。\n"
-                    f"继续发送媒体文件，或发送 /done_media 完成上传，或发送 /skip_media 跳过该步骤。"
-                )
+            if alive:
+                # 根据模式设置不同的限制
+                media_limit = 50 if mode == "media" else 10
+                limit_reached = media_count >= media_limit
                 
+                # 限制媒体数量，新媒体直接追加一行
+                if not limit_reached:
+                    kind, file_id = new_media
+                    await conn.execute(SQL_INSERT_MEDIA, (user_id, kind, file_id, user_id))
+                    media_count += 1
     except Exception as e:
-        logger.error(f"媒体保存错误: {e}")
+        logger.error("媒体保存错误: %s", e)
         await update.message.reply_text("❌ 媒体保存失败，请稍后再试")
         return ConversationHandler.END
+    
+    if not alive:
+        await update.message.reply_text("❌ 会话已过期，请重新发送 /start")
+        return ConversationHandler.END
+    
+    if limit_reached:
+        await update.message.reply_text(f"⚠️ 已达到媒体上传上限（{media_limit}个）")
+        return STATE['MEDIA']
+    
+    logger.info("当前媒体数量：%s", media_count)
+    
+    # 根据模式提供不同的提示
+    if mode == "media":
+        await update.message.reply_text(
+            f"✅ 已接收媒体，共计 {media_count} 个。\n"
+            f"继续发送媒体文件，或发送 /done_media 完成上传。"
+        )
+    else:
+        await update.message.reply_text(
+            f"✅ 已接收媒体，共计 {media_count} 个。\n"
+            f"继续发送媒体文件，或发送 /done_media 完成上传，或发送 /skip_media 跳过该步骤。"
+        )
         
     return STATE['MEDIA']
 
@@ -164,44 +165,32 @@ async def done_media(update: Update, context: CallbackContext) -> int:
     Returns:
         int: 下一个会话状态
     """
-    logger.info(f"媒体上传结束，user_id: {update.effective_user.id}")
     user_id = update.effective_user.id
+    logger.info("媒体上传结束，user_id: %s", user_id)
     
     try:
-        async with get_db() as conn:
-            c = await conn.cursor()
-            await c.execute("SELECT image_id, mode FROM submissions WHERE user_id=?", (user_id,))
-            row = await c.fetchone()
-            
-            if not row:
-                await update.message.reply_text("❌ 会话已过期，请重新发送 /start")
-                return ConversationHandler.END
-            
-            # 检查媒体文件是否存在，增强型错误处理
-            media_list = []
-            try:
-                if row["image_id"]:
-                    media_list = json.loads(row["image_id"])
-            except (json.JSONDecodeError, TypeError):
-                media_list = []
-                
-            # sqlite3.Row 对象不支持 get 方法
-            mode = row["mode"] if "mode" in row.keys() else "mixed"
-            mode = mode.lower() if mode else "mixed"
-            
-            # 仅媒体模式下要求至少有一个媒体文件
-            if mode == "media" and not media_list:
-                await update.message.reply_text("⚠️ 请至少发送一个媒体文件")
-                return STATE['MEDIA']
-                
-        # 媒体验证通过，进入标签阶段
-        await update.message.reply_text("✅ 媒体接收完成，请发送标签（必选，最多30个，用逗号分隔，例如：明日方舟，原神）")
-        return STATE['TAG']
-        
+        mode = await get_session_mode(context, user_id)
+        if mode is not None:
+            async with get_db() as conn:
+                async with conn.execute(SQL_COUNT_MEDIA, (user_id,)) as cursor:
+                    media_count = (await cursor.fetchone())[0]
     except Exception as e:
-        logger.error(f"检索媒体错误: {e}")
+        logger.error("检索媒体错误: %s", e)
         await update.message.reply_text("❌ 内部错误，请稍后再试")
         return ConversationHandler.END
+    
+    if mode is None:
+        await update.message.reply_text("❌ 会话已过期，请重新发送 /start")
+        return ConversationHandler.END
+    
+    # 仅媒体模式下要求至少有一个媒体文件
+    if mode == "media" and not media_count:
+        await update.message.reply_text("⚠️ 请至少发送一个媒体文件")
+        return STATE['MEDIA']
+        
+    # 媒体验证通过，进入标签阶段
+    await update.message.reply_text("✅ 媒体接收完成，请发送标签（必选，最多30个，用逗号分隔，例如：明日方舟，原神）")
+    return STATE['TAG']
 
 @validate_state(STATE['MEDIA'])
 async def skip_media(update: Update, context: CallbackContext) -> int:
@@ -215,38 +204,31 @@ async def skip_media(update: Update, context: CallbackContext) -> int:
     Returns:
         int: 下一个会话状态
     """
-    logger.info(f"用户跳过媒体上传，user_id: {update.effective_user.id}")
     user_id = update.effective_user.id
+    logger.info("用户跳过媒体上传，user_id: %s", user_id)
     
     # 检查当前模式
     try:
-        async with get_db() as conn:
-            c = await conn.cursor()
-            await c.execute("SELECT mode FROM submissions WHERE user_id=?", (user_id,))
-            row = await c.fetchone()
-            
-            if not row:
-                await update.message.reply_text("❌ 会话已过期，请重新发送 /start")
-                return ConversationHandler.END
-                
-            # sqlite3.Row 对象不支持 get 方法
-            mode = row["mode"] if "mode" in row.keys() else "mixed"
-            mode = mode.lower() if mode else "mixed"
-            
-            # 媒体模式下不允许跳过媒体上传
-            if mode == "media":
-                await update.message.reply_text("⚠️ 在媒体投稿模式下，媒体文件是必选项。请上传至少一个媒体文件。")
-                return STATE['MEDIA']
-                
-        # 非媒体模式可以跳过
-        await update.message.reply_text("✅ 已跳过媒体上传，请发送标签（必选，最多30个，用逗号分隔，例如：明日方舟，原神）")
-        return STATE['TAG']
-        
+        mode = await get_session_mode(context, user_id)
     except Exception as e:
-        logger.error(f"检查模式错误: {e}")
+        logger.error("检查模式错误: %s", e)
         await update.message.reply_text("❌ 内部错误，请稍后再试")
         return ConversationHandler.END
+    
+    if mode is None:
+        await update.message.reply_text("❌ 会话已过期，请重新发送 /start")
+        return ConversationHandler.END
+    
+    # 媒体模式下不允许跳过媒体上传
+    if mode == "media":
+        await update.message.reply_text("⚠️ 在媒体投稿模式下，媒体文件是必选项。请上传至少一个媒体文件。")
+        return STATE['MEDIA']
+        
+    # 非媒体模式可以跳过
+    await update.message.reply_text("✅ 已跳过媒体上传，请发送标签（必选，最多30个，用逗号分隔，例如：明日方舟，原神）")
+    return STATE['TAG']
 
+@validate_state(STATE['MEDIA'])
 async def prompt_media(update: Update, context: CallbackContext) -> int:
     """
     提示用户发送媒体文件
@@ -261,35 +243,28 @@ async def prompt_media(update: Update, context: CallbackContext) -> int:
     # 检查当前模式
     user_id = update.effective_user.id
     try:
-        async with get_db() as conn:
-            c = await conn.cursor()
-            await c.execute("SELECT mode FROM submissions WHERE user_id=?", (user_id,))
-            row = await c.fetchone()
-            
-            if not row:
-                await update.message.reply_text("❌ 会话已过期，请重新发送 /start")
-                return ConversationHandler.END
-                
-            # sqlite3.Row 对象不支持 get 方法
-            mode = row["mode"] if "mode" in row.keys() else "mixed"
-            mode = mode.lower() if mode else "mixed"
-            
-            # 根据模式提供不同的提示
-            if mode == "media":
-                await update.message.reply_text(
-                    "请发送支持的媒体文件，或发送 /done_media 完成上传\n\n"
-                    "📱 支持的媒体格式：图片、视频、GIF、音频"
-                )
-            else:
-                await update.message.reply_text(
-                    "请发送支持的媒体文件，或发送 /done_media 完成上传，或发送 /skip_media 跳过媒体上传\n\n"
-                    "📱 支持的媒体格式：图片、视频、GIF、音频"
-                )
-                
+        mode = await get_session_mode(context, user_id)
     except Exception as e:
-        logger.error(f"检查模式错误: {e}")
+        logger.error("检查模式错误: %s", e)
         # 默认提示
         await update.message.reply_text("请发送支持的媒体文件，或发送 /done_media 完成上传")
+        return STATE['MEDIA']
+    
+    if mode is None:
+        await update.message.reply_text("❌ 会话已过期，请重新发送 /start")
+        return ConversationHandler.END
+    
+    # 根据模式提供不同的提示
+    if mode == "media":
+        await update.message.reply_text(
+            "请发送支持的媒体文件，或发送 /done_media 完成上传\n\n"
+            "📱 支持的媒体格式：图片、视频、GIF、音频"
+        )
+    else:
+        await update.message.reply_text(
+            "请发送支持的媒体文件，或发送 /done_media 完成上传，或发送 /skip_media 跳过媒体上传\n\n"
+            "📱 支持的媒体格式：图片、视频、GIF、音频"
+        )
     
     return STATE['MEDIA']
 
@@ -309,29 +284,27 @@ async def switch_to_doc_mode(update: Update, context: CallbackContext) -> int:
     user_id = update.effective_user.id
     chat_id = update.effective_chat.id
     
-    logger.info(f"用户请求从媒体模式切换到文档模式，user_id: {user_id}, data: {query.data}")
+    logger.info("用户请求从媒体模式切换到文档模式，user_id: %s, data: %s", user_id, query.data)
     
     # 先确认回调查询，这样用户界面会立即响应
     try:
         await query.answer()
     except Exception as e:
-        logger.warning(f"确认回调查询失败，但将继续处理: {e}")
+        logger.warning("确认回调查询失败，但将继续处理: %s", e)
     
     try:
         # 1. 编辑原消息，告知用户正在切换
         try:
             await query.edit_message_text("✅ 正在切换到文档投稿模式...")
         except Exception as e:
-            logger.warning(f"编辑消息失败，但将继续处理: {e}")
+            logger.warning("编辑消息失败，但将继续处理: %s", e)
         
         # 2. 更新数据库
         async with get_db() as conn:
-            c = await conn.cursor()
-            
             # 更新用户模式为文档模式
-            await c.execute("UPDATE submissions SET mode=?, image_id=?, document_id=? WHERE user_id=?", 
-                            ("document", "[]", "[]", user_id))
-            await conn.commit()
+            await conn.execute(SQL_UPDATE_MODE, ("document", user_id))
+            await conn.execute(SQL_DELETE_MEDIA, (user_id,))
+        get_submission(context)["mode"] = "document"
         
         # 3. 发送新的欢迎消息（简化版本）
         welcome_text = (
@@ -348,7 +321,7 @@ async def switch_to_doc_mode(update: Update, context: CallbackContext) -> int:
         )
         
         await context.bot.send_message(chat_id=chat_id, text=welcome_text)
-        logger.info(f"已成功切换到文档模式，user_id: {user_id}")
+        logger.info("已成功切换到文档模式，user_id: %s", user_id)
         
         # 强制结束当前函数处理
         from telegram.ext import ApplicationHandlerStop
@@ -358,7 +331,7 @@ async def switch_to_doc_mode(update: Update, context: CallbackContext) -> int:
         # 传递ApplicationHandlerStop异常，包含正确的状态
         raise stop
     except Exception as e:
-        logger.error(f"切换到文档模式错误: {e}", exc_info=True)
+        logger.error("切换到文档模式错误: %s", e, exc_info=True)
         try:
             # 尝试通知用户
             await context.bot.send_message(
@@ -366,7 +339,7 @@ async def switch_to_doc_mode(update: Update, context: CallbackContext) -> int:
                 text="❌ 切换模式失败，请发送 /cancel 取消当前会话，然后发送 /start 重新开始"
             )
         except Exception as send_error:
-            logger.error(f"发送错误消息失败: {send_error}", exc_info=True)
+            logger.error("发送错误消息失败: %s", send_error, exc_info=True)
         
         # 保持在当前状态
         return STATE['MEDIA']
\ No newline at end of file
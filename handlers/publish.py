@@ -1,9 +1,9 @@
 """
 投稿发布模块
 """
-import json
 import logging
 import asyncio
+import time
 from telegram import (
     Update,
     InputMediaPhoto,
@@ -13,13 +13,57 @@ from telegram import (
     InputMediaDocument
 )
 from telegram.ext import ConversationHandler, CallbackContext
+from telegram.error import BadRequest, Forbidden
 
 from config.settings import CHANNEL_ID, NET_TIMEOUT, OWNER_ID, NOTIFY_OWNER
-from database.db_manager import get_db, cleanup_old_data
-from utils.helper_functions import build_caption, safe_send
+from database.db_manager import get_db, cleanup_old_data, cleanup_due, pop_session, SQL_SELECT_MEDIA
+from utils.helper_functions import build_caption, safe_send, send_limiter, get_submission, clear_submission
 
 logger = logging.getLogger(__name__)
 
+# 回复组媒体的最大并发发送数，避免触发Telegram API限制
+MEDIA_GROUP_CONCURRENCY = 3
+
+# 单条媒体发送：类型 -> (Bot 方法名, 媒体参数名)
+_SEND_METHODS = {
+    "photo": ("send_photo", "photo"),
+    "video": ("send_video", "video"),
+    "animation": ("send_animation", "animation"),
+    "audio": ("send_audio", "audio"),
+}
+
+# 媒体组：类型 -> InputMedia 类
+_INPUT_MEDIA_CLASSES = {
+    "photo": InputMediaPhoto,
+    "video": InputMediaVideo,
+    "animation": InputMediaAnimation,
+    "audio": InputMediaAudio,
+}
+
+# 支持剧透遮罩的媒体类型（音频不支持 has_spoiler）
+_SPOILER_TYPES = frozenset(("photo", "video", "animation"))
+
+# 管理员不可达（屏蔽机器人或会话不存在）后，在此时长（秒）内不再尝试，避免每次发布都白白等待 API 往返
+OWNER_NOTIFY_RETRY_INTERVAL = 300
+_owner_unreachable_until = 0.0
+
+# 公开频道的投稿链接前缀，CHANNEL_ID 为常量，模块加载时计算一次；非公开频道为 None
+_CHANNEL_LINK_PREFIX = f"https://t.me/{CHANNEL_ID.lstrip('@')}/" if CHANNEL_ID and CHANNEL_ID.startswith('@') else None
+
+MSG_OWNER_UNREACHABLE = "⚠️ 投稿已发布，但无法通知管理员。请直接联系管理员。"
+
+def _caption_parse_mode(caption):
+    """
+    说明文本包含 HTML 标签时才使用 HTML 解析模式，纯文本直接发送
+    
+    Args:
+        caption: 说明文本
+        
+    Returns:
+        str: 'HTML' 或 None
+    """
+    return 'HTML' if caption and '<' in caption else None
+
 async def publish_submission(update: Update, context: CallbackContext) -> int:
     """
     发布投稿到频道
@@ -37,42 +81,36 @@ async def publish_submission(update: Update, context: CallbackContext) -> int:
     Returns:
         int: 会话结束状态
     """
-    user_id = update.effective_user.id
+    user = update.effective_user
+    user_id = user.id
     try:
         async with get_db() as conn:
-            c = await conn.cursor()
-            await c.execute("SELECT * FROM submissions WHERE user_id=?", (user_id,))
-            data = await c.fetchone()
+            # 媒体和文档按上传顺序一次读出，媒体为 (类型, file_id) 列表，文档为 file_id 列表
+            async with conn.execute(SQL_SELECT_MEDIA, (user_id,)) as cursor:
+                files = await cursor.fetchall()
+            # 在同一事务中取出并删除会话记录，重复触发的发布只会有一次读到数据
+            # 文本字段暂存在内存中，数据库只需返回会话本身的列
+            row = await pop_session(conn, user_id)
         
-        if not data:
+        if not row:
             await update.message.reply_text("❌ 数据异常，请重新发送 /start")
             return ConversationHandler.END
-
-        caption = build_caption(data)
-        
-        # 解析媒体和文档数据，增强型错误处理
-        media_list = []
-        doc_list = []
-        
-        try:
-            if data["image_id"]:
-                media_list = json.loads(data["image_id"])
-        except (json.JSONDecodeError, TypeError):
-            logger.warning(f"解析媒体数据失败，user_id: {user_id}")
-            media_list = []
-            
-        try:
-            if data["document_id"]:
-                doc_list = json.loads(data["document_id"])
-        except (json.JSONDecodeError, TypeError):
-            logger.warning(f"解析文档数据失败，user_id: {user_id}")
-            doc_list = []
         
-        if not media_list and not doc_list:
+        # 没有任何文件时直接返回，不必再合并数据和生成说明文本
+        if not files:
             await update.message.reply_text("❌ 未检测到任何上传文件，请重新发送 /start")
             return ConversationHandler.END
+        
+        media_list = [(f["kind"], f["file_id"]) for f in files if f["kind"] != "document"]
+        doc_list = [f["file_id"] for f in files if f["kind"] == "document"]
+        
+        # 文本字段在会话期间暂存在内存中，与数据库中的媒体和文档数据合并
+        data = dict(row)
+        data.update(get_submission(context))
+
+        caption = build_caption(data)
 
-        spoiler_flag = True if data["spoiler"].lower() == "true" else False
+        spoiler_flag = bool(data.get("spoiler"))
         sent_message = None
         
         # 处理媒体文件
@@ -99,9 +137,8 @@ async def publish_submission(update: Update, context: CallbackContext) -> int:
             return ConversationHandler.END
             
         # 生成投稿链接
-        if CHANNEL_ID.startswith('@'):
-            channel_username = CHANNEL_ID.lstrip('@')
-            submission_link = f"https://t.me/{channel_username}/{sent_message.message_id}"
+        if _CHANNEL_LINK_PREFIX:
+            submission_link = f"{_CHANNEL_LINK_PREFIX}{sent_message.message_id}"
         else:
             submission_link = "频道无公开链接"
 
@@ -110,38 +147,13 @@ async def publish_submission(update: Update, context: CallbackContext) -> int:
         )
         
         # 向所有者发送投稿通知
-        if NOTIFY_OWNER and OWNER_ID:
-            # 记录详细的调试信息
-            logger.info(f"准备发送通知: NOTIFY_OWNER={NOTIFY_OWNER}, OWNER_ID={OWNER_ID}, 类型={type(OWNER_ID)}")
-            
-            # 获取用户名信息
-            username = None
-            try:
-                username = data["username"] if "username" in data else f"user{user_id}"
-            except (KeyError, TypeError):
-                username = f"user{user_id}"
-                
-            # 获取用户名信息，优先使用真实用户名
-            user = update.effective_user
-            real_username = user.username or username
-            
-            # 安全处理可能缺失的数据字段
-            try:
-                mode = data["mode"] if "mode" in data else "未知"
-                media_count = len(json.loads(data["image_id"])) if "image_id" in data and data["image_id"] else 0
-                doc_count = len(json.loads(data["document_id"])) if "document_id" in data and data["document_id"] else 0
-                tag_text = data["tag"] if "tag" in data else "无"
-                title_text = data["title"] if "title" in data else "无"
-                spoiler_text = "是" if "spoiler" in data and data["spoiler"] == "true" else "否"
-            except Exception as e:
-                logger.error(f"数据处理错误: {e}")
-                # 设置默认值
-                mode = "未知"
-                media_count = 0
-                doc_count = 0
-                tag_text = "无"
-                title_text = "无"
-                spoiler_text = "否"
+        if NOTIFY_OWNER and OWNER_ID and time.monotonic() < _owner_unreachable_until:
+            # 管理员近期确认不可达，暂不重试，也不必构建通知内容
+            logger.debug("管理员 %s 近期无法接收通知，跳过本次通知", OWNER_ID)
+            await update.message.reply_text(MSG_OWNER_UNREACHABLE)
+        elif NOTIFY_OWNER and OWNER_ID:
+            # 获取用户名信息，优先使用真实用户名（data 已是普通 dict）
+            real_username = user.username or data.get("username") or f"user{user_id}"
             
             # 构建纯文本通知消息（不使用任何Markdown，确保最大兼容性）
             notification_text = (
@@ -158,72 +170,69 @@ async def publish_submission(update: Update, context: CallbackContext) -> int:
                 f"查看黑名单: /blacklist_list"
             )
             
-            try:
-                # 确保OWNER_ID被转换为整数
-                logger.info(f"尝试将OWNER_ID转换为整数: {OWNER_ID}")
-                owner_id_int = int(OWNER_ID)
-                logger.info(f"转换成功，准备发送通知到: {owner_id_int}")
-                
-                # 记录通知消息内容
-                logger.info(f"通知消息长度: {len(notification_text)}, 使用纯文本格式")
-                
-                # 简化尝试逻辑 - 直接使用纯文本，不尝试任何格式化
-                try:
-                    message = await context.bot.send_message(
-                        chat_id=owner_id_int,
-                        text=notification_text
-                    )
-                    logger.info(f"通知发送成功！消息ID: {message.message_id}")
-                except Exception as e:
-                    logger.error(f"发送通知失败: {e}")
-                    # 尝试使用更简化的消息
-                    try:
-                        simple_msg = f"📨 新投稿通知 - 用户 {real_username} (ID: {user_id}) 发布了新投稿\n链接: {submission_link}\n\n封禁命令: /blacklist_add {user_id} 违规内容"
-                        await context.bot.send_message(
-                            chat_id=owner_id_int,
-                            text=simple_msg
-                        )
-                        logger.info("使用简化消息成功发送通知")
-                    except Exception as e2:
-                        logger.error(f"发送简化通知也失败: {e2}")
-                        # 通知用户有问题
-                        await update.message.reply_text(
-                            "⚠️ 投稿已发布，但无法通知管理员。请直接联系管理员。"
-                        )
-            except ValueError as e:
-                logger.error(f"OWNER_ID格式不正确，无法转换为整数: {OWNER_ID}, 错误: {e}")
-                await update.message.reply_text(f"⚠️ 配置错误：OWNER_ID格式不正确。请联系开发者修复配置。")
-            except Exception as e:
-                logger.error(f"处理通知过程中发生其他错误: 错误类型: {type(e)}, 详细信息: {str(e)}")
-                logger.error("异常追踪: ", exc_info=True)
+            
+            # 通知结果不影响本次发布，放到后台发送，投稿人无需等待这次 API 往返
+            context.application.create_task(_notify_owner(update, context, notification_text))
         else:
-            logger.info(f"不发送通知: NOTIFY_OWNER={NOTIFY_OWNER}, OWNER_ID={OWNER_ID}")
+            logger.debug("不发送通知: NOTIFY_OWNER=%s, OWNER_ID=%s", NOTIFY_OWNER, OWNER_ID)
         
     except Exception as e:
-        logger.error(f"发布投稿失败: {e}")
+        logger.error("发布投稿失败: %s", e)
         await update.message.reply_text(f"❌ 发布失败，请联系管理员。错误信息：{str(e)}")
     finally:
-        # 清理用户会话数据
-        try:
-            async with get_db() as conn:
-                c = await conn.cursor()
-                await c.execute("DELETE FROM submissions WHERE user_id=?", (user_id,))
-            logger.info(f"已删除用户 {user_id} 的投稿记录")
-        except Exception as e:
-            logger.error(f"删除数据错误: {e}")
+        # 清理用户会话数据，数据库中的记录已在读取时删除
+        clear_submission(context)
         
-        # 清理过期数据
-        await cleanup_old_data()
+        # 清理过期数据放到后台执行，不阻塞本次回复（定期任务也会兜底清理）
+        if cleanup_due():
+            context.application.create_task(cleanup_old_data())
     
     return ConversationHandler.END
 
+async def _notify_owner(update, context, notification_text):
+    """
+    向管理员发送投稿通知，在后台任务中执行，异常只记录日志不向外抛出
+    
+    网络错误交由 safe_send 重试；只有管理员确实不可达（屏蔽了机器人或会话不存在）时，
+    才在一段时间内暂停通知。发送失败时提示投稿人。
+    
+    Args:
+        update: Telegram 更新对象
+        context: 回调上下文
+        notification_text: 通知消息
+    """
+    global _owner_unreachable_until
+    try:
+        logger.debug("准备发送通知到: %s，消息长度: %s", OWNER_ID, len(notification_text))
+        try:
+            message = await safe_send(
+                context.bot.send_message,
+                chat_id=OWNER_ID,
+                text=notification_text,
+                raise_errors=True
+            )
+        except Exception as e:
+            logger.error("发送通知失败: %s", e)
+            if isinstance(e, Forbidden) or (isinstance(e, BadRequest) and "chat not found" in str(e).lower()):
+                _owner_unreachable_until = time.monotonic() + OWNER_NOTIFY_RETRY_INTERVAL
+            message = None
+        
+        if message:
+            logger.debug("通知发送成功！消息ID: %s", message.message_id)
+        else:
+            # 通知用户有问题
+            await update.message.reply_text(MSG_OWNER_UNREACHABLE)
+    except Exception as e:
+        logger.error("处理通知过程中发生其他错误: 错误类型: %s, 详细信息: %s", type(e), e)
+        logger.error("异常追踪: ", exc_info=True)
+
 async def handle_media_publish(context, media_list, caption, spoiler_flag):
     """
     处理媒体发布
     
     Args:
         context: 回调上下文
-        media_list: 媒体列表
+        media_list: 媒体列表，元素为 (类型, file_id)
         caption: 说明文本
         spoiler_flag: 是否剧透标志
         
@@ -237,70 +246,42 @@ async def handle_media_publish(context, media_list, caption, spoiler_flag):
     # 不管SHOW_SUBMITTER如何设置，当caption超过850字符时都单独发送
     # 使用较小的阈值（850而不是1000）来确保足够的安全边际
     if caption and len(caption) > 850:
-        logger.info(f"Caption过长 ({len(caption)} 字符)，单独发送caption")
+        logger.info("Caption过长 (%s 字符)，单独发送caption", len(caption))
         try:
             caption_message = await safe_send(
                 context.bot.send_message,
                 chat_id=CHANNEL_ID,
                 text=caption,
-                parse_mode='HTML'
+                parse_mode=_caption_parse_mode(caption)
             )
             # 媒体组将不再包含caption
             caption = None
         except Exception as e:
-            logger.error(f"发送长caption失败: {e}")
+            logger.error("发送长caption失败: %s", e)
             # 继续尝试发送媒体，但不带caption
 
     # 单个媒体处理
     if len(media_list) == 1:
-        typ, file_id = media_list[0].split(":", 1)
+        typ, file_id = media_list[0]
         try:
             # 如果已经单独发送了caption，则不再添加到媒体
             media_caption = None if caption_message else caption
             
-            if typ == "photo":
-                sent_message = await safe_send(
-                    context.bot.send_photo,
-                    chat_id=CHANNEL_ID,
-                    photo=file_id,
-                    caption=media_caption,
-                    parse_mode='HTML' if media_caption else None,
-                    has_spoiler=spoiler_flag,
-                    reply_to_message_id=caption_message.message_id if caption_message else None
-                )
-            elif typ == "video":
-                sent_message = await safe_send(
-                    context.bot.send_video,
-                    chat_id=CHANNEL_ID,
-                    video=file_id,
-                    caption=media_caption,
-                    parse_mode='HTML' if media_caption else None,
-                    has_spoiler=spoiler_flag,
-                    reply_to_message_id=caption_message.message_id if caption_message else None
-                )
-            elif typ == "animation":
-                sent_message = await safe_send(
-                    context.bot.send_animation,
-                    chat_id=CHANNEL_ID,
-                    animation=file_id,
-                    caption=media_caption,
-                    parse_mode='HTML' if media_caption else None,
-                    has_spoiler=spoiler_flag,
-                    reply_to_message_id=caption_message.message_id if caption_message else None
-                )
-            elif typ == "audio":
-                sent_message = await safe_send(
-                    context.bot.send_audio,
-                    chat_id=CHANNEL_ID,
-                    audio=file_id,
-                    caption=media_caption,
-                    parse_mode='HTML' if media_caption else None,
-                    reply_to_message_id=caption_message.message_id if caption_message else None
-                )
+            method_name, media_arg = _SEND_METHODS[typ]
+            extra = {"has_spoiler": spoiler_flag} if typ in _SPOILER_TYPES else {}
+            sent_message = await safe_send(
+                getattr(context.bot, method_name),
+                chat_id=CHANNEL_ID,
+                caption=media_caption,
+                parse_mode=_caption_parse_mode(media_caption),
+                reply_to_message_id=caption_message.message_id if caption_message else None,
+                **{media_arg: file_id},
+                **extra
+            )
             
             return caption_message or sent_message
         except Exception as e:
-            logger.error(f"发送单条媒体失败: {e}")
+            logger.error("发送单条媒体失败: %s", e)
             return caption_message  # 如果至少发送了caption消息，则返回它
     
     # 多个媒体处理 - 将媒体分组，每组最多10个
@@ -311,136 +292,134 @@ async def handle_media_publish(context, media_list, caption, spoiler_flag):
             total_groups = (len(media_list) + 9) // 10  # 向上取整计算总组数
             first_message = caption_message  # 如果单独发送了caption，用它作为第一条消息
             
+            # 只在第一个媒体添加说明（如果caption不为None且没有单独发送）
+            # 强制设置简短的caption，即使SHOW_SUBMITTER=True也能可靠发送
+            first_caption = None if caption_message else caption
+            input_media = [
+                _build_input_media(typ, file_id, first_caption if i == 0 else None, spoiler_flag)
+                for i, (typ, file_id) in enumerate(media_list)
+            ]
+            
             # 将媒体列表分成每组最多10个项目
-            for chunk_index in range(0, len(media_list), 10):
-                media_chunk = media_list[chunk_index:chunk_index + 10]
-                media_group = []
-                
-                group_number = chunk_index // 10 + 1
-                logger.info(f"处理第{group_number}组媒体，共{len(media_chunk)}个项目 (总共{total_groups}组)")
-                
-                for i, m in enumerate(media_chunk):
-                    typ, file_id = m.split(":", 1)
-                    # 只在第一组的第一个媒体添加说明（如果caption不为None且没有单独发送）
-                    # 强制设置简短的caption，即使SHOW_SUBMITTER=True也能可靠发送
-                    use_caption = caption if (chunk_index == 0 and i == 0 and caption is not None and not caption_message) else None
-                    use_parse_mode = 'HTML' if use_caption else None
-                    
-                    if typ == "photo":
-                        media_group.append(InputMediaPhoto(
-                            media=file_id,
-                            caption=use_caption,
-                            parse_mode=use_parse_mode,
-                            has_spoiler=spoiler_flag
-                        ))
-                    elif typ == "video":
-                        media_group.append(InputMediaVideo(
-                            media=file_id,
-                            caption=use_caption,
-                            parse_mode=use_parse_mode,
-                            has_spoiler=spoiler_flag
-                        ))
-                    elif typ == "animation":
-                        media_group.append(InputMediaAnimation(
-                            media=file_id,
-                            caption=use_caption,
-                            parse_mode=use_parse_mode,
-                            has_spoiler=spoiler_flag
-                        ))
-                    elif typ == "audio":
-                        media_group.append(InputMediaAudio(
-                            media=file_id,
-                            caption=use_caption,
-                            parse_mode=use_parse_mode
-                        ))
+            pending_groups = [
+                (chunk_index // 10 + 1, input_media[chunk_index:chunk_index + 10])
+                for chunk_index in range(0, len(input_media), 10)
+            ]
+            
+            # 首组需要先发送成功，后续组才有可以回复的消息
+            while pending_groups and first_message is None:
+                group_number, media_group = pending_groups.pop(0)
+                logger.debug("发送第%s组媒体（首组），%s个媒体项目 (总共%s组)", group_number, len(media_group), total_groups)
+                sent_messages = await _send_media_group_chunk(context, media_group, group_number)
+                if sent_messages:
+                    all_sent_messages.extend(sent_messages)
+                    first_message = sent_messages[0]  # 保存第一条消息，用于回复
+                    success_groups += 1
+                if pending_groups:
+                    # 给Telegram API处理首组的时间，避免API限制
+                    await asyncio.sleep(2)
+            
+            # 其余各组都回复到第一条消息，彼此独立，限制并发数后同时发送
+            if pending_groups:
+                semaphore = asyncio.Semaphore(MEDIA_GROUP_CONCURRENCY)
+                reply_to_id = first_message.message_id
                 
-                # 发送当前组，增加超时参数
-                extended_timeout = 60  # 更长的超时时间，避免误判为超时
-                if first_message is None:
-                    logger.info(f"发送第{group_number}组媒体（首组），{len(media_group)}个媒体项目")
-                    # 第一组直接发送
-                    try:
-                        sent_messages = await asyncio.wait_for(
-                            context.bot.send_media_group(
-                                chat_id=CHANNEL_ID,
-                                media=media_group
-                            ),
-                            timeout=extended_timeout
-                        )
-                        
-                        if sent_messages and len(sent_messages) > 0:
-                            all_sent_messages.extend(sent_messages)
-                            first_message = sent_messages[0]  # 保存第一条消息，用于回复
-                            logger.info(f"第{group_number}组媒体发送成功，message_id={first_message.message_id}")
-                            success_groups += 1
-                        else:
-                            logger.error(f"第{group_number}组媒体发送返回空结果")
-                    except asyncio.TimeoutError:
-                        logger.warning(f"第{group_number}组媒体发送超时，但可能已成功发送")
-                        # 即使超时，尝试继续后续组的发送
-                        # 等待3秒，让Telegram服务器有时间处理
-                        await asyncio.sleep(3)
-                    except Exception as e:
-                        logger.error(f"第{group_number}组媒体发送失败: {e}")
-                        
-                        # 如果是网络相关错误，休眠更长时间后继续
-                        if any(keyword in str(e).lower() for keyword in ["network", "connection", "timeout"]):
-                            await asyncio.sleep(5)
-                else:
-                    logger.info(f"发送第{group_number}组媒体（回复组），{len(media_group)}个媒体项目，回复到message_id={first_message.message_id}")
-                    # 后续组作为回复发送到第一条消息
-                    try:
-                        sent_messages = await asyncio.wait_for(
-                            context.bot.send_media_group(
-                                chat_id=CHANNEL_ID,
-                                media=media_group,
-                                reply_to_message_id=first_message.message_id
-                            ),
-                            timeout=extended_timeout
-                        )
-                        
-                        if sent_messages and len(sent_messages) > 0:
-                            all_sent_messages.extend(sent_messages)
-                            logger.info(f"第{group_number}组媒体发送成功，第一条message_id={sent_messages[0].message_id}")
-                            success_groups += 1
-                        else:
-                            logger.error(f"第{group_number}组媒体发送返回空结果")
-                    except asyncio.TimeoutError:
-                        logger.warning(f"第{group_number}组媒体发送超时，但可能已成功发送")
-                        # 即使超时，尝试继续后续组的发送
-                        # 等待3秒，让Telegram服务器有时间处理
-                        await asyncio.sleep(3)
-                    except Exception as e:
-                        logger.error(f"第{group_number}组媒体发送失败: {e}")
-                        
-                        # 如果是网络相关错误，休眠更长时间后继续
-                        if any(keyword in str(e).lower() for keyword in ["network", "connection", "timeout"]):
-                            await asyncio.sleep(5)
+                async def send_reply_group(group_number, media_group):
+                    async with semaphore:
+                        logger.debug("发送第%s组媒体（回复组），%s个媒体项目，回复到message_id=%s", group_number, len(media_group), reply_to_id)
+                        return await _send_media_group_chunk(context, media_group, group_number, reply_to_id)
                 
-                # 添加更长的延迟，避免API限制
-                # 每组之间等待2秒，给Telegram API更多处理时间
-                await asyncio.sleep(2)
+                results = await asyncio.gather(
+                    *(send_reply_group(group_number, media_group) for group_number, media_group in pending_groups)
+                )
+                for sent_messages in results:
+                    if sent_messages:
+                        all_sent_messages.extend(sent_messages)
+                        success_groups += 1
             
             # 计算实际处理的媒体数量并记录结果
             total_media_estimate = success_groups * 10
             if success_groups < total_groups and len(all_sent_messages) == 0:
-                logger.warning(f"媒体发送部分超时，预计已发送约{total_media_estimate}个媒体项目（可能不准确）")
+                logger.warning("媒体发送部分超时，预计已发送约%s个媒体项目（可能不准确）", total_media_estimate)
             else:
-                logger.info(f"所有媒体发送完成，{success_groups}/{total_groups}组成功，共{len(all_sent_messages)}个媒体项目成功记录")
+                logger.info("所有媒体发送完成，%s/%s组成功，共%s个媒体项目成功记录", success_groups, total_groups, len(all_sent_messages))
             
             # 返回第一条消息或任何成功发送的消息
             return first_message if first_message else (all_sent_messages[0] if all_sent_messages else None)
         except Exception as e:
-            logger.error(f"发送媒体组失败: {e}")
+            logger.error("发送媒体组失败: %s", e)
             return caption_message  # 如果至少发送了caption消息，则返回它
 
+def _build_input_media(typ, file_id, caption, spoiler_flag):
+    """
+    构建媒体组中的单个媒体对象
+    
+    Args:
+        typ: 媒体类型
+        file_id: Telegram 文件 ID
+        caption: 说明文本，None 表示不带说明
+        spoiler_flag: 是否剧透标志
+        
+    Returns:
+        InputMedia 对象
+    """
+    extra = {"has_spoiler": spoiler_flag} if typ in _SPOILER_TYPES else {}
+    return _INPUT_MEDIA_CLASSES[typ](
+        media=file_id,
+        caption=caption,
+        parse_mode=_caption_parse_mode(caption),
+        **extra
+    )
+
+async def _send_media_group_chunk(context, media_group, group_number, reply_to_message_id=None):
+    """
+    发送一组媒体，超时或失败时记录日志并返回空列表
+    
+    Args:
+        context: 回调上下文
+        media_group: 当前组的媒体列表
+        group_number: 组序号（用于日志）
+        reply_to_message_id: 回复的消息ID，首组为None
+        
+    Returns:
+        list: 发送成功的消息列表
+    """
+    extended_timeout = 60  # 更长的超时时间，避免误判为超时
+    try:
+        # 媒体组中的每个媒体都计为一条消息
+        await send_limiter.acquire(len(media_group))
+        sent_messages = await asyncio.wait_for(
+            context.bot.send_media_group(
+                chat_id=CHANNEL_ID,
+                media=media_group,
+                reply_to_message_id=reply_to_message_id
+            ),
+            timeout=extended_timeout
+        )
+        
+        if sent_messages and len(sent_messages) > 0:
+            logger.debug("第%s组媒体发送成功，第一条message_id=%s", group_number, sent_messages[0].message_id)
+            return list(sent_messages)
+        logger.error("第%s组媒体发送返回空结果", group_number)
+    except asyncio.TimeoutError:
+        logger.warning("第%s组媒体发送超时，但可能已成功发送", group_number)
+        # 等待3秒，让Telegram服务器有时间处理
+        await asyncio.sleep(3)
+    except Exception as e:
+        logger.error("第%s组媒体发送失败: %s", group_number, e)
+        
+        # 如果是网络相关错误，休眠更长时间后继续
+        if any(keyword in str(e).lower() for keyword in ["network", "connection", "timeout"]):
+            await asyncio.sleep(5)
+    return []
+
 async def handle_document_publish(context, doc_list, caption=None, reply_to_message_id=None):
     """
     处理文档发布
     
     Args:
         context: 回调上下文
-        doc_list: 文档列表
+        doc_list: 文档 file_id 列表
         caption: 说明文本，如果为None则不添加说明
         reply_to_message_id: 回复的消息ID，如果为None则创建新消息
         
@@ -449,35 +428,34 @@ async def handle_document_publish(context, doc_list, caption=None, reply_to_mess
     """
     if len(doc_list) == 1 and caption is not None:
         # 单个文档处理
-        _, file_id = doc_list[0].split(":", 1)
         try:
             return await safe_send(
                 context.bot.send_document,
                 chat_id=CHANNEL_ID,
-                document=file_id,
+                document=doc_list[0],
                 caption=caption,
-                parse_mode='HTML',
+                parse_mode=_caption_parse_mode(caption),
                 reply_to_message_id=reply_to_message_id
             )
         except Exception as e:
-            logger.error(f"发送单个文档失败: {e}")
+            logger.error("发送单个文档失败: %s", e)
             return None
     else:
         # 多个文档处理，使用文档组
         try:
             doc_media_group = []
-            for i, doc_item in enumerate(doc_list):
-                _, file_id = doc_item.split(":", 1)
+            for i, file_id in enumerate(doc_list):
                 # 只在最后一个文档添加说明，且caption不为None
                 caption_to_use = caption if (i == len(doc_list) - 1 and caption is not None) else None
                 doc_media_group.append(InputMediaDocument(
                     media=file_id,
                     caption=caption_to_use,
-                    parse_mode='HTML' if caption_to_use else None
+                    parse_mode=_caption_parse_mode(caption_to_use)
                 ))
             
             sent_docs = await safe_send(
                 context.bot.send_media_group,
+                send_tokens=len(doc_media_group),
                 chat_id=CHANNEL_ID,
                 media=doc_media_group,
                 reply_to_message_id=reply_to_message_id
@@ -487,5 +465,5 @@ async def handle_document_publish(context, doc_list, caption=None, reply_to_mess
                 return sent_docs[0]
             return None
         except Exception as e:
-            logger.error(f"发送文档组失败: {e}")
+            logger.error("发送文档组失败: %s", e)
             return None
\ No newline at end of file
@@ -3,13 +3,11 @@
 处理标签、链接、标题、简介和剧透设置
 """
 import logging
-from datetime import datetime
 from telegram import Update
-from telegram.ext import ConversationHandler, CallbackContext
+from telegram.ext import CallbackContext
 
 from models.state import STATE
-from database.db_manager import get_db
-from utils.helper_functions import validate_state, process_tags
+from utils.helper_functions import validate_state, process_tags, get_submission
 from handlers.publish import publish_submission
 
 logger = logging.getLogger(__name__)
@@ -26,23 +24,15 @@ async def handle_tag(update: Update, context: CallbackContext) -> int:
     Returns:
         int: 下一个会话状态
     """
-    logger.info(f"处理标签输入，user_id: {update.effective_user.id}")
     user_id = update.effective_user.id
+    logger.info("处理标签输入，user_id: %s", user_id)
     raw_tags = update.message.text.strip()
     success, processed_tags = process_tags(raw_tags)
     if not success or not processed_tags:
         await update.message.reply_text("❌ 标签格式错误，请重新输入（最多30个，用逗号分隔）")
         return STATE['TAG']
-    try:
-        async with get_db() as conn:
-            c = await conn.cursor()
-            await c.execute("UPDATE submissions SET tags=?, timestamp=? WHERE user_id=?",
-                      (processed_tags, datetime.now().timestamp(), user_id))
-        logger.info(f"标签保存成功，user_id: {user_id}")
-    except Exception as e:
-        logger.error(f"标签保存错误: {e}")
-        await update.message.reply_text("❌ 标签保存失败，请稍后再试")
-        return ConversationHandler.END
+    get_submission(context)["tags"] = processed_tags
+    logger.info("标签保存成功，user_id: %s", user_id)
     await update.message.reply_text(
         "✅ 标签已保存，请发送链接（可选，如无需请回复\"无\"，需填写请以 http:// 或 https:// 开头，或发送 /skip_optional 跳过后续所有可选项）"
     )
@@ -60,24 +50,16 @@ async def handle_link(update: Update, context: CallbackContext) -> int:
     Returns:
         int: 下一个会话状态
     """
-    logger.info(f"处理链接输入，user_id: {update.effective_user.id}")
     user_id = update.effective_user.id
+    logger.info("处理链接输入，user_id: %s", user_id)
     link = update.message.text.strip()
-    if link.lower() == "无":
+    if link == "无":
         link = ""
     elif not link.startswith(('http://', 'https://')):
         await update.message.reply_text("⚠️ 链接格式不正确，请以 http:// 或 https:// 开头，或回复\"无\"跳过")
         return STATE['LINK']
-    try:
-        async with get_db() as conn:
-            c = await conn.cursor()
-            await c.execute("UPDATE submissions SET link=?, timestamp=? WHERE user_id=?",
-                      (link, datetime.now().timestamp(), user_id))
-        logger.info(f"链接保存成功，user_id: {user_id}")
-    except Exception as e:
-        logger.error(f"链接保存错误: {e}")
-        await update.message.reply_text("❌ 链接保存失败，请稍后再试")
-        return ConversationHandler.END
+    get_submission(context)["link"] = link
+    logger.info("链接保存成功，user_id: %s", user_id)
     await update.message.reply_text("✅ 链接已保存，请发送标题（可选，如无需请回复\"无\"，或发送 /skip_optional 跳过后续所有可选项）")
     return STATE['TITLE']
 
@@ -93,20 +75,12 @@ async def handle_title(update: Update, context: CallbackContext) -> int:
     Returns:
         int: 下一个会话状态
     """
-    logger.info(f"处理标题输入，user_id: {update.effective_user.id}")
     user_id = update.effective_user.id
+    logger.info("处理标题输入，user_id: %s", user_id)
     title = update.message.text.strip()
-    title_to_store = "" if title.lower() == "无" else title[:100]
-    try:
-        async with get_db() as conn:
-            c = await conn.cursor()
-            await c.execute("UPDATE submissions SET title=?, timestamp=? WHERE user_id=?",
-                      (title_to_store, datetime.now().timestamp(), user_id))
-        logger.info(f"标题保存成功，user_id: {user_id}")
-    except Exception as e:
-        logger.error(f"标题保存错误: {e}")
-        await update.message.reply_text("❌ 标题保存失败，请稍后再试")
-        return ConversationHandler.END
+    title_to_store = "" if title == "无" else title[:100]
+    get_submission(context)["title"] = title_to_store
+    logger.info("标题保存成功，user_id: %s", user_id)
     await update.message.reply_text("✅ 标题已保存，请发送简介（可选，如无需请回复\"无\"，或发送 /skip_optional 跳过后续所有可选项）")
     return STATE['NOTE']
 
@@ -122,20 +96,12 @@ async def handle_note(update: Update, context: CallbackContext) -> int:
     Returns:
         int: 下一个会话状态
     """
-    logger.info(f"处理简介输入，user_id: {update.effective_user.id}")
     user_id = update.effective_user.id
+    logger.info("处理简介输入，user_id: %s", user_id)
     note = update.message.text.strip()
-    note_to_store = "" if note.lower() == "无" else note[:600]
-    try:
-        async with get_db() as conn:
-            c = await conn.cursor()
-            await c.execute("UPDATE submissions SET note=?, timestamp=? WHERE user_id=?",
-                      (note_to_store, datetime.now().timestamp(), user_id))
-        logger.info(f"简介保存成功，user_id: {user_id}")
-    except Exception as e:
-        logger.error(f"简介保存错误: {e}")
-        await update.message.reply_text("❌ 简介保存失败，请稍后再试")
-        return ConversationHandler.END
+    note_to_store = "" if note == "无" else note[:600]
+    get_submission(context)["note"] = note_to_store
+    logger.info("简介保存成功，user_id: %s", user_id)
     await update.message.reply_text("✅ 简介已保存，请问是否将内容设为剧透（点击查看）？回复 \"否\" 或 \"是\"")
     return STATE['SPOILER']
 
@@ -151,20 +117,12 @@ async def handle_spoiler(update: Update, context: CallbackContext) -> int:
     Returns:
         int: 下一个会话状态或结束状态
     """
-    logger.info(f"处理剧透选择，user_id: {update.effective_user.id}")
     user_id = update.effective_user.id
+    logger.info("处理剧透选择，user_id: %s", user_id)
     answer = update.message.text.strip()
-    spoiler_flag = True if answer == "是" else False
-    try:
-        async with get_db() as conn:
-            c = await conn.cursor()
-            await c.execute("UPDATE submissions SET spoiler=?, timestamp=? WHERE user_id=?",
-                      ("true" if spoiler_flag else "false", datetime.now().timestamp(), user_id))
-        logger.info(f"剧透选择保存成功，user_id: {user_id}，spoiler: {spoiler_flag}")
-    except Exception as e:
-        logger.error(f"剧透保存错误: {e}")
-        await update.message.reply_text("❌ 剧透选择保存失败，请稍后再试")
-        return ConversationHandler.END
+    spoiler_flag = answer == "是"
+    get_submission(context)["spoiler"] = spoiler_flag
+    logger.info("剧透选择保存成功，user_id: %s，spoiler: %s", user_id, spoiler_flag)
     await update.message.reply_text("✅ 剧透选择已保存，正在发布投稿……")
     return await publish_submission(update, context)
 
@@ -181,17 +139,8 @@ async def skip_optional_link(update: Update, context: CallbackContext) -> int:
     Returns:
         int: 下一个会话状态
     """
-    logger.info(f"跳过链接、标题、简介，user_id: {update.effective_user.id}")
-    user_id = update.effective_user.id
-    try:
-        async with get_db() as conn:
-            c = await conn.cursor()
-            await c.execute("UPDATE submissions SET link=?, title=?, note=?, timestamp=? WHERE user_id=?",
-                      ("", "", "", datetime.now().timestamp(), user_id))
-    except Exception as e:
-        logger.error(f"/skip_optional 执行错误: {e}")
-        await update.message.reply_text("❌ 跳过可选项失败，请稍后再试")
-        return ConversationHandler.END
+    logger.info("跳过链接、标题、简介，user_id: %s", update.effective_user.id)
+    get_submission(context).update(link="", title="", note="")
     await update.message.reply_text("✅ 链接、标题、简介已跳过，请问是否将内容设为剧透（点击查看）？回复 \"否\" 或 \"是\"")
     return STATE['SPOILER']
 
@@ -207,17 +156,8 @@ async def skip_optional_title(update: Update, context: CallbackContext) -> int:
     Returns:
         int: 下一个会话状态
     """
-    logger.info(f"跳过标题、简介，user_id: {update.effective_user.id}")
-    user_id = update.effective_user.id
-    try:
-        async with get_db() as conn:
-            c = await conn.cursor()
-            await c.execute("UPDATE submissions SET title=?, note=?, timestamp=? WHERE user_id=?",
-                      ("", "", datetime.now().timestamp(), user_id))
-    except Exception as e:
-        logger.error(f"/skip_optional 执行错误: {e}")
-        await update.message.reply_text("❌ 跳过可选项失败，请稍后再试")
-        return ConversationHandler.END
+    logger.info("跳过标题、简介，user_id: %s", update.effective_user.id)
+    get_submission(context).update(title="", note="")
     await update.message.reply_text("✅ 标题、简介已跳过，请问是否将内容设为剧透（点击查看）？回复 \"否\" 或 \"是\"")
     return STATE['SPOILER']
 
@@ -233,16 +173,7 @@ async def skip_optional_note(update: Update, context: CallbackContext) -> int:
     Returns:
         int: 下一个会话状态
     """
-    logger.info(f"跳过简介，user_id: {update.effective_user.id}")
-    user_id = update.effective_user.id
-    try:
-        async with get_db() as conn:
-            c = await conn.cursor()
-            await c.execute("UPDATE submissions SET note=?, timestamp=? WHERE user_id=?",
-                      ("", datetime.now().timestamp(), user_id))
-    except Exception as e:
-        logger.error(f"/skip_optional 执行错误: {e}")
-        await update.message.reply_text("❌ 跳过可选项失败，请稍后再试")
-        return ConversationHandler.END
+    logger.info("跳过简介，user_id: %s", update.effective_user.id)
+    get_submission(context)["note"] = ""
     await update.message.reply_text("✅ 简介已跳过，请问是否将内容设为剧透（点击查看）？回复 \"否\" 或 \"是\"")
     return STATE['SPOILER']
\ No newline at end of file
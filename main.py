@@ -8,7 +8,7 @@ import signal
 import asyncio
 import platform
 import logging
-import os
+import time
 from datetime import datetime, time as datetime_time
 from telegram import Update
 from telegram.ext import (
@@ -19,21 +19,21 @@ from telegram.ext import (
     ConversationHandler,
     CallbackContext,
     ApplicationHandlerStop,
-    CallbackQueryHandler
+    CallbackQueryHandler,
+    TypeHandler
 )
-from dotenv import load_dotenv
 
 # 配置相关导入
-from config.settings import TOKEN, TIMEOUT, BOT_MODE, MODE_MEDIA, MODE_DOCUMENT, MODE_MIXED
+from config.settings import TOKEN, TIMEOUT, NET_TIMEOUT, BOT_MODE, MODE_MEDIA, MODE_DOCUMENT, MODE_MIXED
 from models.state import STATE
 
 # 数据库相关导入
-from database.db_manager import init_db, cleanup_old_data, get_db
+from database.db_manager import init_db, cleanup_old_data, get_db, close_db
 from utils.database import (
-    get_user_state, 
+    touch_user_activity, 
     delete_user_state, 
-    is_blacklisted, 
-    initialize_database
+    initialize_database,
+    close_connection
 )
 
 # 工具函数导入
@@ -50,7 +50,7 @@ from handlers import (
 
 # 黑名单管理
 from utils.blacklist import manage_blacklist, init_blacklist, blacklist_filter
-from handlers.command_handlers import blacklist_add, blacklist_remove, blacklist_list, catch_all, debug
+from handlers.command_handlers import blacklist_add, blacklist_import, blacklist_remove, blacklist_list, catch_all, debug
 
 # 投稿处理
 from handlers.publish import publish_submission
@@ -77,23 +77,45 @@ from handlers.error_handler import error_handler
 logger = logging.getLogger(__name__)
 setup_logging()
 
-# 加载环境变量
-load_dotenv()
+# 各状态中接受的普通文本输入（排除命令）
+TEXT_INPUT_FILTER = filters.TEXT & ~filters.COMMAND
 
-# 全局变量
-TIMEOUT_SECONDS = int(os.getenv("SESSION_TIMEOUT", "900"))  # 默认15分钟
+# 媒体上传状态接受的消息类型（包括以文件形式发送的 GIF 和音频）
+MEDIA_FILTER = (filters.PHOTO | filters.VIDEO | filters.ANIMATION | filters.AUDIO |
+                filters.Document.Category("animation") | filters.Document.AUDIO)
 
-# 黑名单过滤函数包装器
-def check_blacklist(handler_func):
-    """黑名单过滤函数包装器"""
-    async def wrapper(update, context):
-        # 先进行黑名单检查
-        if not blacklist_filter(update):
-            # 如果在黑名单中，直接返回
-            return
-        # 不在黑名单中，调用原始处理函数
-        return await handler_func(update, context)
-    return wrapper
+# 黑名单拦截处理器
+async def _reply_quietly(message, text: str, error_desc: str) -> None:
+    """
+    回复消息并吞掉发送异常，供中间件以后台任务方式调用
+    
+    Args:
+        message: 要回复的消息对象
+        text: 回复内容
+        error_desc: 发送失败时的日志描述
+    """
+    try:
+        await message.reply_text(text)
+    except Exception as e:
+        logger.error(f"{error_desc}: {e}")
+
+async def blacklist_gate(update: Update, context: CallbackContext) -> None:
+    """
+    在所有普通处理器之前拦截黑名单用户的更新，每个更新只检查一次
+    
+    Args:
+        update: Telegram 更新对象
+        context: 回调上下文
+    """
+    if blacklist_filter(update):
+        return
+    if update.message:
+        # 回复放到后台发送，不让网络往返阻塞后续更新的处理
+        context.application.create_task(_reply_quietly(
+            update.message, "❌ 您已被列入黑名单，无法使用此机器人。", "回复黑名单用户失败"
+        ))
+    # 阻止后续分组的处理器继续处理此更新
+    raise ApplicationHandlerStop
 
 # 会话超时检查函数
 async def check_conversation_timeout(update: Update, context: CallbackContext) -> None:
@@ -111,49 +133,44 @@ async def check_conversation_timeout(update: Update, context: CallbackContext) -
     
     # 对命令消息进行特殊处理 - 命令直接通过，不检查超时
     if update.message and update.message.text and update.message.text.startswith('/'):
-        command = update.message.text.split()[0]  # 获取命令部分
-        logger.debug(f"跳过命令消息的超时检查: {command}")
+        # 仅在开启 DEBUG 时才切分出命令部分用于日志
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("跳过命令消息的超时检查: %s", update.message.text.split()[0])
         # 关键点：对于命令消息，不进行任何阻止，直接通过
         return
     
-    # 检查用户是否在黑名单中
-    if is_blacklisted(user_id):
-        logger.warning(f"黑名单用户 {user_id} 尝试发送消息")
-        await update.message.reply_text("❌ 您已被列入黑名单，无法使用此机器人。")
-        return ApplicationHandlerStop()
-    
     # 尝试获取用户会话状态
     try:
-        user_state = get_user_state(user_id)
+        # 最后活动时间缓存在内存中，取值的同时刷新为当前时间
+        last_activity = touch_user_activity(user_id)
         
         # 如果用户没有会话，允许正常流程继续
-        if not user_state:
-            logger.debug(f"用户 {user_id} 没有活跃会话，不检查超时")
+        if last_activity is None:
+            logger.debug("用户 %s 没有活跃会话，不检查超时", user_id)
             return
         
         # 检查超时
-        import time
         current_time = time.time()
-        last_activity = user_state.get("last_activity", 0)
         time_diff = current_time - last_activity
         
-        if time_diff > TIMEOUT_SECONDS:
-            logger.info(f"用户 {user_id} 会话超时 ({time_diff:.2f}秒 > {TIMEOUT_SECONDS}秒)")
+        if time_diff > TIMEOUT:
+            logger.info(f"用户 {user_id} 会话超时 ({time_diff:.2f}秒 > {TIMEOUT}秒)")
             
             # 删除用户会话数据
             delete_user_state(user_id)
             
-            # 向用户发送超时通知
-            try:
-                await update.message.reply_text(
-                    "⏱️ 您的会话已超时。请发送 /start 重新开始。"
-                )
-            except Exception as e:
-                logger.error(f"发送超时通知失败: {e}")
+            # 向用户发送超时通知，后台发送，无需等待结果
+            if update.message:
+                context.application.create_task(_reply_quietly(
+                    update.message, "⏱️ 您的会话已超时。请发送 /start 重新开始。", "发送超时通知失败"
+                ))
             
-            return ApplicationHandlerStop()
+            # 阻止后续分组的处理器继续处理此更新
+            raise ApplicationHandlerStop
         
-        logger.debug(f"用户 {user_id} 会话活跃 ({time_diff:.2f}秒 < {TIMEOUT_SECONDS}秒)")
+        logger.debug("用户 %s 会话活跃 (%.2f秒 < %s秒)", user_id, time_diff, TIMEOUT)
+    except ApplicationHandlerStop:
+        raise
     except Exception as e:
         logger.error(f"检查会话超时时发生错误: {e}")
         # 出错时不阻止消息处理继续，而是让正常流程继续
@@ -164,7 +181,7 @@ async def check_conversation_timeout(update: Update, context: CallbackContext) -
 async def log_all_updates(update: Update, context: CallbackContext) -> None:
     """记录所有接收到的更新"""
     if update.message and update.message.text:
-        logger.info(f"收到命令: {update.message.text} 来自用户: {update.effective_user.id}")
+        logger.info("收到命令: %s 来自用户: %s", update.message.text, update.effective_user.id)
     return None  # 允许更新继续传递给其他处理器
 
 async def main():
@@ -172,7 +189,7 @@ async def main():
     主函数 - 设置并启动机器人
     """
     logger.info(f"启动TeleSubmit机器人。版本: {CONFIG.get('VERSION', '0.1.0')}")
-    logger.info(f"会话超时时间: {TIMEOUT_SECONDS}秒")
+    logger.info(f"会话超时时间: {TIMEOUT}秒")
     
     # 初始化数据库
     await init_db()
@@ -188,7 +205,15 @@ async def main():
         sys.exit(1)
         
     # 创建Application实例
-    application = Application.builder().token(token).build()
+    # 连接池沿用 PTB 默认的 256 个连接；HTTPX 默认 5 秒的读写超时对媒体组上传过短，
+    # 会在 safe_send 自身的超时之前误报超时，因此统一使用 NET_TIMEOUT（长轮询有单独的设置，不受影响）
+    application = (
+        Application.builder()
+        .token(token)
+        .read_timeout(NET_TIMEOUT)
+        .write_timeout(NET_TIMEOUT)
+        .build()
+    )
     
     # 设置应用程序
     setup_application(application)
@@ -224,6 +249,10 @@ async def shutdown(application, signal, loop):
     await application.stop()
     await application.shutdown()
     
+    # 关闭数据库连接
+    await close_db()
+    close_connection()
+    
     # 结束事件循环
     loop.stop()
 
@@ -240,6 +269,7 @@ def setup_application(application):
         logger.info("注册高优先级命令处理器...")
         application.add_handler(CommandHandler('debug', debug), group=-998)
         application.add_handler(CommandHandler('blacklist_add', blacklist_add), group=-998)
+        application.add_handler(CommandHandler('blacklist_import', blacklist_import), group=-998)
         application.add_handler(CommandHandler('blacklist_remove', blacklist_remove), group=-998)
         application.add_handler(CommandHandler('blacklist_list', blacklist_list), group=-998)
         # 不再注册高优先级的cancel命令，只在ConversationHandler的fallbacks中注册
@@ -248,6 +278,9 @@ def setup_application(application):
     except Exception as e:
         logger.error(f"注册高优先级命令处理器失败: {e}", exc_info=True)
     
+    # 黑名单用户的更新在此统一拦截，不再进入会话超时检查和会话处理器
+    application.add_handler(TypeHandler(Update, blacklist_gate), group=-1)
+    
     # 注册错误处理
     application.add_error_handler(error_handler)
     
@@ -270,55 +303,53 @@ def setup_application(application):
             states={
                 # 模式选择状态
                 STATE.get('START_MODE', 0): [
-                    MessageHandler(filters.TEXT & ~filters.COMMAND, select_mode)
+                    MessageHandler(TEXT_INPUT_FILTER, select_mode)
                 ],
                 
                 # 文档和媒体处理状态 - 优先处理skip_media命令
                 STATE.get('MEDIA', 2): [
                     CommandHandler('done_media', done_media),
                     CommandHandler('skip_media', skip_media),
-                    MessageHandler(filters.PHOTO | filters.VIDEO | filters.ANIMATION | filters.AUDIO |
-                                 filters.Document.Category("animation") | filters.Document.AUDIO, 
-                                 handle_media),
+                    MessageHandler(MEDIA_FILTER, handle_media),
                     # 在媒体状态下也检查文档类型
                     MessageHandler(filters.Document.ALL, handle_media),
                     # 添加媒体模式切换回调
                     CallbackQueryHandler(switch_to_doc_mode, pattern="^switch_to_doc$"),
-                    MessageHandler(filters.TEXT & ~filters.COMMAND, prompt_media)
+                    MessageHandler(TEXT_INPUT_FILTER, prompt_media)
                 ],
                 STATE.get('DOC', 1): [
                     CommandHandler('done_doc', done_doc),
                     MessageHandler(filters.Document.ALL, handle_doc),
-                    MessageHandler(filters.TEXT & ~filters.COMMAND, prompt_doc)
+                    MessageHandler(TEXT_INPUT_FILTER, prompt_doc)
                 ],
                 
                 # 其他状态
-                STATE.get('TEXT', 10): [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text)],
+                STATE.get('TEXT', 10): [MessageHandler(TEXT_INPUT_FILTER, handle_text)],
                 STATE.get('IMAGE', 11): [
                     MessageHandler(filters.PHOTO | filters.CAPTION, handle_image),
                     CommandHandler("done_img", done_image)
                 ],
-                STATE.get('EXTRA', 12): [MessageHandler(filters.TEXT & ~filters.COMMAND, collect_extra)],
+                STATE.get('EXTRA', 12): [MessageHandler(TEXT_INPUT_FILTER, collect_extra)],
                 STATE.get('PUBLISH', 13): [
                     CallbackQueryHandler(publish_submission, pattern="^publish$"),
                     CallbackQueryHandler(cancel, pattern="^cancel$")
                 ],
                 
                 # 投稿处理状态
-                STATE.get('TAG', 4): [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_tag)],
+                STATE.get('TAG', 4): [MessageHandler(TEXT_INPUT_FILTER, handle_tag)],
                 STATE.get('LINK', 5): [
                     CommandHandler('skip_optional', skip_optional_link),
-                    MessageHandler(filters.TEXT & ~filters.COMMAND, handle_link)
+                    MessageHandler(TEXT_INPUT_FILTER, handle_link)
                 ],
                 STATE.get('TITLE', 6): [
                     CommandHandler('skip_optional', skip_optional_title),
-                    MessageHandler(filters.TEXT & ~filters.COMMAND, handle_title)
+                    MessageHandler(TEXT_INPUT_FILTER, handle_title)
                 ],
                 STATE.get('NOTE', 7): [
                     CommandHandler('skip_optional', skip_optional_note),
-                    MessageHandler(filters.TEXT & ~filters.COMMAND, handle_note)
+                    MessageHandler(TEXT_INPUT_FILTER, handle_note)
                 ],
-                STATE.get('SPOILER', 8): [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_spoiler)]
+                STATE.get('SPOILER', 8): [MessageHandler(TEXT_INPUT_FILTER, handle_spoiler)]
             },
             fallbacks=[CommandHandler("cancel", cancel)],
             name="submission_conversation",
@@ -337,17 +368,18 @@ def setup_application(application):
     try:
         logger.info("设置定期任务...")
         job_queue = application.job_queue
-        job_queue.run_repeating(
-            lambda context: asyncio.create_task(cleanup_old_data()), 
-            interval=300, 
-            first=10
-        )
+        
+        async def cleanup_data_job(context):
+            """定期清理过期会话数据，协程由 JobQueue 直接等待，异常交给其错误处理"""
+            await cleanup_old_data()
+        
+        job_queue.run_repeating(cleanup_data_job, interval=300, first=10)
         
         # 添加周期性清理日志任务
-        def clean_logs_job(context):
-            """定期清理日志文件"""
+        async def clean_logs_job(context):
+            """定期清理日志文件，文件操作放到线程中执行，不阻塞事件循环"""
             logger.info("执行定期日志清理任务")
-            cleanup_old_logs("logs")
+            await asyncio.to_thread(cleanup_old_logs, "logs")
             
         # 每天凌晨3点执行一次日志清理
         job_queue.run_daily(clean_logs_job, time=datetime_time(hour=3, minute=0))
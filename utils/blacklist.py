@@ -3,7 +3,8 @@
 """
 import logging
 import aiosqlite
-from typing import List, Set, Optional
+from datetime import datetime, timezone
+from typing import Dict, List, Set, Optional, Tuple
 
 from database.db_manager import get_db
 from config.settings import OWNER_ID
@@ -12,6 +13,17 @@ logger = logging.getLogger(__name__)
 
 # 内存中的黑名单缓存
 _blacklist: Set[int] = set()
+# 黑名单详情缓存（user_id -> {"reason", "added_at"}），与数据库同步维护
+_blacklist_info: Dict[int, dict] = {}
+
+def _utc_timestamp() -> str:
+    """
+    生成与 SQLite CURRENT_TIMESTAMP 格式一致的 UTC 时间字符串
+    
+    Returns:
+        str: 形如 YYYY-MM-DD HH:MM:SS 的时间字符串
+    """
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
 
 # 自定义黑名单过滤器函数
 def blacklist_filter(update):
@@ -32,14 +44,14 @@ async def init_blacklist():
                     added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
             ''')
-            await conn.commit()
             
             # 加载黑名单到内存
-            async with conn.execute("SELECT user_id FROM blacklist") as cursor:
+            async with conn.execute("SELECT user_id, reason, added_at FROM blacklist") as cursor:
                 rows = await cursor.fetchall()
+                _blacklist_info.clear()
+                _blacklist_info.update({row[0]: {"reason": row[1], "added_at": row[2]} for row in rows})
                 _blacklist.clear()
-                for row in rows:
-                    _blacklist.add(row[0])
+                _blacklist.update(_blacklist_info)
                     
         logger.info(f"黑名单已初始化，当前有 {len(_blacklist)} 个用户")
     except Exception as e:
@@ -57,21 +69,60 @@ async def add_to_blacklist(user_id: int, reason: str = "未指定原因") -> boo
         bool: 是否成功添加
     """
     try:
+        added_at = _utc_timestamp()
         async with get_db() as conn:
             await conn.execute(
-                "INSERT OR REPLACE INTO blacklist (user_id, reason) VALUES (?, ?)",
-                (user_id, reason)
+                "INSERT OR REPLACE INTO blacklist (user_id, reason, added_at) VALUES (?, ?, ?)",
+                (user_id, reason, added_at)
             )
-            await conn.commit()
             
         # 更新内存缓存
         _blacklist.add(user_id)
+        _blacklist_info[user_id] = {"reason": reason, "added_at": added_at}
         logger.info(f"已将用户 {user_id} 添加到黑名单，原因: {reason}")
         return True
     except Exception as e:
         logger.error(f"添加用户到黑名单时出错: {e}")
         return False
 
+async def add_many_to_blacklist(entries: List[Tuple[int, str]]) -> int:
+    """
+    批量添加用户到黑名单，在同一事务中一次性写入
+    
+    已在黑名单中的用户保持原有记录不变。
+    
+    Args:
+        entries: (用户ID, 原因) 列表
+        
+    Returns:
+        int: 新添加的用户数量，出错时返回 -1
+    """
+    # 去重并跳过已在黑名单中的用户
+    new_entries: Dict[int, str] = {}
+    for user_id, reason in entries:
+        if user_id not in _blacklist and user_id not in new_entries:
+            new_entries[user_id] = reason or "未指定原因"
+    if not new_entries:
+        return 0
+    
+    try:
+        added_at = _utc_timestamp()
+        async with get_db() as conn:
+            await conn.executemany(
+                "INSERT OR IGNORE INTO blacklist (user_id, reason, added_at) VALUES (?, ?, ?)",
+                [(user_id, reason, added_at) for user_id, reason in new_entries.items()]
+            )
+            
+        # 更新内存缓存
+        for user_id, reason in new_entries.items():
+            _blacklist.add(user_id)
+            _blacklist_info[user_id] = {"reason": reason, "added_at": added_at}
+        logger.info(f"已批量添加 {len(new_entries)} 个用户到黑名单")
+        return len(new_entries)
+    except Exception as e:
+        logger.error(f"批量添加用户到黑名单时出错: {e}")
+        return -1
+
 async def remove_from_blacklist(user_id: int) -> bool:
     """
     从黑名单中移除用户
@@ -84,40 +135,33 @@ async def remove_from_blacklist(user_id: int) -> bool:
     """
     try:
         async with get_db() as conn:
-            await conn.execute("DELETE FROM blacklist WHERE user_id = ?", (user_id,))
-            await conn.commit()
+            async with conn.execute("DELETE FROM blacklist WHERE user_id = ?", (user_id,)) as cursor:
+                # 以数据库实际删除的行数为准，缓存与数据库不一致时也能正确返回
+                removed = cursor.rowcount > 0 or user_id in _blacklist
             
-            if user_id in _blacklist:
-                _blacklist.remove(user_id)
+            _blacklist_info.pop(user_id, None)
+            _blacklist.discard(user_id)
+            if removed:
                 logger.info(f"已将用户 {user_id} 从黑名单中移除")
-                return True
             else:
                 logger.info(f"用户 {user_id} 不在黑名单中")
-                return False
+            return removed
     except Exception as e:
         logger.error(f"从黑名单中移除用户时出错: {e}")
         return False
 
 async def get_blacklist() -> List[dict]:
     """
-    获取完整黑名单
+    获取完整黑名单（来自内存缓存）
     
     Returns:
         List[dict]: 黑名单用户列表，每个用户包含 user_id, reason, added_at
     """
-    try:
-        async with get_db() as conn:
-            async with conn.execute(
-                "SELECT user_id, reason, added_at FROM blacklist ORDER BY added_at DESC"
-            ) as cursor:
-                rows = await cursor.fetchall()
-                return [
-                    {"user_id": row[0], "reason": row[1], "added_at": row[2]}
-                    for row in rows
-                ]
-    except Exception as e:
-        logger.error(f"获取黑名单时出错: {e}")
-        return []
+    # 直接读取内存缓存，按添加时间倒序排列
+    return [
+        {"user_id": uid, "reason": info["reason"], "added_at": info["added_at"]}
+        for uid, info in sorted(_blacklist_info.items(), key=lambda item: item[1]["added_at"] or "", reverse=True)
+    ]
 
 def is_blacklisted(user_id: int) -> bool:
     """
@@ -141,46 +185,8 @@ def is_owner(user_id: int) -> bool:
     Returns:
         bool: 用户是否为机器人所有者
     """
-    try:
-        # 记录输入参数
-        logger.info(f"is_owner被调用 - 检查用户ID: {user_id} (类型: {type(user_id)})")
-        
-        # 检查user_id是否有效
-        if user_id is None:
-            logger.warning("is_owner被调用但user_id为None")
-            return False
-            
-        # 首先检查OWNER_ID是否存在
-        if not OWNER_ID:
-            logger.warning(f"OWNER_ID未设置或为空，用户{user_id}的所有者检查失败")
-            return False
-        
-        # 确保user_id是整数
-        try:
-            user_id_int = int(user_id)
-        except (ValueError, TypeError):
-            logger.error(f"user_id无法转换为整数: {user_id}")
-            return False
-            
-        # 确保OWNER_ID是整数或者可以转换为整数
-        try:
-            owner_id_int = int(OWNER_ID)
-        except (ValueError, TypeError):
-            logger.error(f"OWNER_ID无法转换为整数: {OWNER_ID}")
-            return False
-            
-        # 使用整数进行直接比较
-        result = user_id_int == owner_id_int
-        
-        # 记录详细的日志
-        logger.warning(f"所有者检查 - 用户ID: {user_id_int}, OWNER_ID: {owner_id_int}, 结果: {result}")
-        
-        return result
-            
-    except Exception as e:
-        # 捕获任何可能的异常
-        logger.error(f"所有者检查过程中发生错误: {e}", exc_info=True)
-        return False
+    # OWNER_ID 已在配置加载时转换为整数，这里只做一次比较
+    return OWNER_ID is not None and user_id == OWNER_ID
 
 async def manage_blacklist(update, context):
     """
@@ -202,6 +208,7 @@ async def manage_blacklist(update, context):
     await update.message.reply_text(
         "📋 黑名单管理命令：\n\n"
         "/blacklist_add <user_id> [原因] - 将用户添加到黑名单\n"
+        "/blacklist_import - 批量导入黑名单（每行: <user_id> [原因]）\n"
         "/blacklist_remove <user_id> - 将用户从黑名单中移除\n"
         "/blacklist_list - 列出所有黑名单用户"
     ) 
\ No newline at end of file
@@ -3,13 +3,21 @@ import sqlite3
 import time
 import threading
 from functools import wraps
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 
 logger = logging.getLogger(__name__)
 
 # 连接锁，确保线程安全
 db_lock = threading.RLock()
 
+# 进程内共享的数据库连接，由 db_lock 串行化访问
+_connection = None
+
+# user_sessions 中各用户最后活动时间的内存副本（user_id -> 时间戳）
+# 本进程是该表唯一的写入者，启动时整表载入，之后随保存/删除同步维护，
+# 会话超时检查只需查字典，不必每条消息都访问数据库
+_last_activity: Dict[int, float] = {}
+
 # 重试装饰器
 def retry_on_db_error(max_attempts=3, delay=1):
     """数据库操作重试装饰器"""
@@ -35,19 +43,36 @@ def retry_on_db_error(max_attempts=3, delay=1):
 # 初始化数据库连接
 @retry_on_db_error()
 def get_connection():
-    """获取数据库连接，确保线程安全"""
+    """获取共享数据库连接，首次调用时建立连接（调用方需持有 db_lock）"""
+    global _connection
+    if _connection is not None:
+        return _connection
     try:
-        conn = sqlite3.connect("telesubmit.db", timeout=10)  # 增加超时时间
+        conn = sqlite3.connect("telesubmit.db", timeout=10, check_same_thread=False)  # 增加超时时间
         conn.row_factory = sqlite3.Row
         # 启用外键约束
         conn.execute("PRAGMA foreign_keys = ON")
         # 启用WAL模式，提高并发性能
         conn.execute("PRAGMA journal_mode = WAL")
+        # WAL 下使用 NORMAL 同步级别，避免每次提交都 fsync
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        conn.execute("PRAGMA cache_size = -64000")
+        conn.execute("PRAGMA busy_timeout = 5000")
+        _connection = conn
         return conn
     except sqlite3.Error as e:
         logger.error(f"无法连接到数据库: {e}")
         raise
 
+def close_connection():
+    """关闭共享数据库连接"""
+    global _connection
+    with db_lock:
+        if _connection is not None:
+            _connection.close()
+            _connection = None
+
 # 确保数据库和表格已创建
 @retry_on_db_error()
 def initialize_database():
@@ -77,13 +102,15 @@ def initialize_database():
             ''')
             
             conn.commit()
+            
+            # 载入已有会话的最后活动时间
+            cursor.execute("SELECT user_id, last_activity FROM user_sessions")
+            _last_activity.clear()
+            _last_activity.update((row["user_id"], row["last_activity"] or 0) for row in cursor.fetchall())
             logger.info("成功初始化用户会话和黑名单数据库")
         except sqlite3.Error as e:
             logger.error(f"初始化用户会话数据库失败: {e}")
             raise
-        finally:
-            if 'conn' in locals():
-                conn.close()
 
 # 用户会话相关操作
 @retry_on_db_error()
@@ -101,14 +128,12 @@ def save_user_state(user_id, state, data=None):
             )
             
             conn.commit()
+            _last_activity[user_id] = timestamp
             logger.debug(f"已保存用户 {user_id} 的状态: {state}")
             return True
         except sqlite3.Error as e:
             logger.error(f"保存用户状态失败 (用户ID: {user_id}): {e}")
             raise
-        finally:
-            if 'conn' in locals():
-                conn.close()
 
 @retry_on_db_error()
 def get_user_state(user_id):
@@ -126,6 +151,7 @@ def get_user_state(user_id):
                 timestamp = time.time()
                 cursor.execute("UPDATE user_sessions SET last_activity = ? WHERE user_id = ?", (timestamp, user_id))
                 conn.commit()
+                _last_activity[user_id] = timestamp
                 
                 return {
                     "state": result["state"],
@@ -136,9 +162,21 @@ def get_user_state(user_id):
         except sqlite3.Error as e:
             logger.error(f"获取用户状态失败 (用户ID: {user_id}): {e}")
             raise
-        finally:
-            if 'conn' in locals():
-                conn.close()
+
+def touch_user_activity(user_id: int) -> Optional[float]:
+    """
+    刷新用户的最后活动时间（仅内存），并返回刷新前的时间
+    
+    Args:
+        user_id: 用户ID
+        
+    Returns:
+        Optional[float]: 上次活动时间；用户没有会话时返回 None
+    """
+    last_activity = _last_activity.get(user_id)
+    if last_activity is not None:
+        _last_activity[user_id] = time.time()
+    return last_activity
 
 @retry_on_db_error()
 def delete_user_state(user_id):
@@ -150,15 +188,13 @@ def delete_user_state(user_id):
             
             cursor.execute("DELETE FROM user_sessions WHERE user_id = ?", (user_id,))
             conn.commit()
+            _last_activity.pop(user_id, None)
             
             logger.info(f"已删除用户 {user_id} 的会话数据")
             return cursor.rowcount > 0
         except sqlite3.Error as e:
             logger.error(f"删除用户状态失败 (用户ID: {user_id}): {e}")
             raise
-        finally:
-            if 'conn' in locals():
-                conn.close()
 
 @retry_on_db_error()
 def get_all_active_sessions():
@@ -184,9 +220,6 @@ def get_all_active_sessions():
         except sqlite3.Error as e:
             logger.error(f"获取所有活跃会话失败: {e}")
             raise
-        finally:
-            if 'conn' in locals():
-                conn.close()
 
 # 黑名单相关操作
 @retry_on_db_error()
@@ -209,9 +242,6 @@ def add_to_blacklist(user_id, reason=None):
         except sqlite3.Error as e:
             logger.error(f"添加用户到黑名单失败 (用户ID: {user_id}): {e}")
             raise
-        finally:
-            if 'conn' in locals():
-                conn.close()
 
 @retry_on_db_error()
 def remove_from_blacklist(user_id):
@@ -234,9 +264,6 @@ def remove_from_blacklist(user_id):
         except sqlite3.Error as e:
             logger.error(f"从黑名单中移除用户失败 (用户ID: {user_id}): {e}")
             raise
-        finally:
-            if 'conn' in locals():
-                conn.close()
 
 def is_blacklisted(user_id: int) -> bool:
     """
@@ -282,9 +309,6 @@ def get_blacklist():
         except sqlite3.Error as e:
             logger.error(f"获取黑名单失败: {e}")
             raise
-        finally:
-            if 'conn' in locals():
-                conn.close()
 
 def get_all_user_states() -> Dict[int, Dict[str, Any]]:
     """
@@ -3,18 +3,22 @@
 """
 import re
 import json
+import time
+import random
 import asyncio
 import logging
-from functools import lru_cache, wraps
+from functools import wraps
 from datetime import datetime
 from telegram import Update
 from telegram.ext import ConversationHandler, CallbackContext
+from telegram.error import BadRequest, NetworkError, RetryAfter
 
 from config.settings import ALLOWED_TAGS, NET_TIMEOUT, SHOW_SUBMITTER
-from database.db_manager import get_db
+from database.db_manager import get_db, SESSION_TOUCH_INTERVAL, SQL_SELECT_MODE, SQL_TOUCH_SUBMISSION
 
 logger = logging.getLogger(__name__)
 
+
 # 标签分割正则表达式
 TAG_SPLIT_PATTERN = re.compile(r'[,\s，]+')
 
@@ -28,7 +32,6 @@ CONFIG = {
     "RETRY_DELAY": 2,   # 重试延迟（秒）
 }
 
-@lru_cache(maxsize=128)
 def process_tags(raw_tags: str) -> tuple:
     """
     处理标签字符串
@@ -44,18 +47,15 @@ def process_tags(raw_tags: str) -> tuple:
         tags = [t.strip().lower() for t in TAG_SPLIT_PATTERN.split(raw_tags) if t.strip()]
         tags = tags[:ALLOWED_TAGS]
         
-        # 确保每个标签前加上#，如果标签已经有#，则不重复添加
-        processed = [f"#{tag}" if not tag.startswith("#") else tag for tag in tags]
-        
-        # 处理标签长度超过30的情况
-        processed = [tag[:30] if len(tag) > 0 else tag for tag in processed]
-        
-        # 使用空格拼接标签，得到正确的格式
-        return True, ' '.join(processed)
+        # 确保每个标签前加上#（已有#则不重复添加），截断到30个字符，再用空格拼接
+        return True, ' '.join((tag if tag.startswith("#") else f"#{tag}")[:30] for tag in tags)
     except Exception as e:
         logger.error(f"标签处理错误: {e}")
         return False, ""
 
+# 需要转义的特殊字符 -> 加反斜杠后的形式，供 str.translate 一次性替换
+_MARKDOWN_ESCAPE_TABLE = str.maketrans({c: f"\\{c}" for c in r'\_*[]()~>#+-=|{}.!'})
+
 def escape_markdown(text: str) -> str:
     """
     转义 HTML 中的特殊字符
@@ -66,8 +66,14 @@ def escape_markdown(text: str) -> str:
     Returns:
         str: 转义后的文本
     """
-    escape_chars = r'\_*[]()~>#+-=|{}.!'
-    return ''.join(f"\\{c}" if c in escape_chars else c for c in text)
+    return text.translate(_MARKDOWN_ESCAPE_TABLE)
+
+# Telegram 的最大 caption 长度
+MAX_CAPTION_LENGTH = 1024
+
+def _note_part(note: str) -> str:
+    # "简介"部分要求第一行为标签，后面跟内容
+    return f"📝 简介：\n{note}" if note else ""
 
 def build_caption(data) -> str:
     """
@@ -79,132 +85,130 @@ def build_caption(data) -> str:
     Returns:
         str: 格式化的说明文本
     """
-    MAX_CAPTION_LENGTH = 1024  # Telegram 的最大 caption 长度
-
-    def get_link_part(link: str) -> str:
-        return f"🔗 链接： {link}" if link else ""
-    
-    def get_title_part(title: str) -> str:
-        return f"🔖 标题： \n【{title}】" if title else ""
-    
-    def get_note_part(note: str) -> str:
-        # "简介"部分要求第一行为标签，后面跟内容
-        return f"📝 简介：\n{note}" if note else ""
-    
-    def get_tags_part(tags: str) -> str:
-        return f"🏷 Tags: {tags}" if tags else ""
-    
-    def get_spoiler_part(spoiler: str) -> str:
-        return "⚠️点击查看⚠️" if spoiler.lower() == "true" else ""
-    
-    def get_submitter_part(user_id: int) -> str:
-        if not SHOW_SUBMITTER:
-            return ""
-        
-        # 获取保存的用户名，如果存在的话
-        # sqlite3.Row对象不支持get()方法，使用try-except处理
-        try:
-            username = data["username"] if "username" in data else f"user{user_id}"
-        except (KeyError, TypeError):
-            username = f"user{user_id}"
-        
-        # 构建用户链接，可以通过点击访问用户资料
-        return f"\n\n投稿人：<a href=\"tg://user?id={user_id}\">@{username}</a>"
-
-    # 收集各部分，只有内容不为空时才添加，避免产生多余的换行
-    parts = []
-    
-    # 安全获取属性，防止访问不存在的键
-    try:
-        link = get_link_part(data["link"] if data["link"] else "")
-        if link:
-            parts.append(link)
-    except (KeyError, TypeError):
-        pass
-
-    try:
-        title = get_title_part(data["title"] if data["title"] else "")
-        if title:
-            parts.append(title)
-    except (KeyError, TypeError):
-        pass
-
-    try:
-        note = get_note_part(data["note"] if data["note"] else "")
-        if note:
-            parts.append(note)
-    except (KeyError, TypeError):
-        pass
-
-    try:
-        tags = get_tags_part(data["tags"] if data["tags"] else "")
-        if tags:
-            parts.append(tags)
-    except (KeyError, TypeError):
-        pass
-    
-    # 将各部分按换行符连接，避免空值带来多余换行
-    caption_body = "\n".join(parts)
+    # sqlite3.Row 等映射统一转换为 dict，缺失的字段用 get 取默认值
+    if not isinstance(data, dict):
+        data = dict(data)
+    raw_note = data.get("note") or ""
+    link = data.get("link") or ""
+    title = data.get("title") or ""
+    tags = data.get("tags") or ""
     
-    try:
-        spoiler = get_spoiler_part(data["spoiler"] if data["spoiler"] else "false")
-    except (KeyError, TypeError):
-        spoiler = ""
+    link = f"🔗 链接： {link}" if link else ""
+    title = f"🔖 标题： \n【{title}】" if title else ""
+    note = _note_part(raw_note)
+    tags = f"🏷 Tags: {tags}" if tags else ""
+    spoiler = "⚠️点击查看⚠️" if data.get("spoiler") else ""
     
-    # 添加投稿人信息（如果启用）
-    try:
-        submitter = get_submitter_part(data["user_id"])
-    except (KeyError, TypeError):
+    # 添加投稿人信息（如果启用），可以通过点击访问用户资料
+    user_id = data.get("user_id")
+    if SHOW_SUBMITTER and user_id is not None:
+        username = data.get("username") or f"user{user_id}"
+        submitter = f"\n\n投稿人：<a href=\"tg://user?id={user_id}\">@{username}</a>"
+    else:
         submitter = ""
     
+    # 收集各部分，只有内容不为空时才添加，并按换行符连接，避免空值带来多余换行
+    caption_body = "\n".join(part for part in (link, title, note, tags) if part)
+    
     # 如果存在正文内容且有剧透提示，则剧透提示单独占一行
     if caption_body:
         full_caption = f"{spoiler}\n{caption_body}{submitter}" if spoiler else f"{caption_body}{submitter}"
     else:
         full_caption = f"{spoiler}{submitter}" if submitter else spoiler
 
-    # 如果整体长度在允许范围内，则直接返回
+    # 绝大多数投稿不超长，直接返回；超长时才进入截断逻辑
     if len(full_caption) <= MAX_CAPTION_LENGTH:
         return full_caption
+    return _build_truncated_caption(link, title, raw_note, tags, spoiler, submitter)
 
-    # 超长情况：保留投稿人信息，尝试截断 note 部分（其他部分保持不变）
-    fixed_parts = []
-    if link:
-        fixed_parts.append(link)
-    if title:
-        fixed_parts.append(title)
-    if tags:
-        fixed_parts.append(tags)
-    fixed_text = "\n".join(fixed_parts)
+def _build_truncated_caption(link: str, title: str, raw_note: str, tags: str,
+                             spoiler: str, submitter: str) -> str:
+    """
+    超长情况：保留投稿人信息，截断 note 部分（其他部分保持不变）
+    
+    Args:
+        link: 已格式化的链接部分
+        title: 已格式化的标题部分
+        raw_note: 原始简介内容
+        tags: 已格式化的标签部分
+        spoiler: 剧透提示
+        submitter: 投稿人信息
+        
+    Returns:
+        str: 截断后的说明文本
+    """
+    fixed_text = "\n".join(part for part in (link, title, tags) if part)
     
     # 预留剧透提示、投稿人信息和固定部分所占长度以及连接换行符
     prefix = f"{spoiler}\n" if spoiler and fixed_text else spoiler
-    # 计算可用长度（要为投稿人信息预留空间）
-    connector = "\n" if fixed_text and note else ""
+    connector = "\n" if fixed_text and raw_note else ""
     available_length = MAX_CAPTION_LENGTH - len(prefix) - len(fixed_text) - len(connector) - len(submitter)
     
-    try:
-        truncated_note = (data["note"][:available_length] + "...") if (available_length > 0 and data["note"]) else ""
-    except (KeyError, TypeError):
-        truncated_note = ""
-        
-    truncated_note_part = get_note_part(truncated_note)
+    truncated_note = (raw_note[:available_length] + "...") if (available_length > 0 and raw_note) else ""
     
     # 重新组装各部分
-    parts = []
-    if link:
-        parts.append(link)
-    if title:
-        parts.append(title)
-    if truncated_note_part:
-        parts.append(truncated_note_part)
-    if tags:
-        parts.append(tags)
-    caption_body = "\n".join(parts)
+    caption_body = "\n".join(part for part in (link, title, _note_part(truncated_note), tags) if part)
     full_caption = f"{spoiler}\n{caption_body}{submitter}" if spoiler and caption_body else f"{spoiler or caption_body}{submitter}"
 
     return full_caption[:MAX_CAPTION_LENGTH]
 
+def get_submission(context: CallbackContext) -> dict:
+    """
+    获取会话期间暂存在内存中的投稿文本字段（标签、链接、标题、简介、剧透）
+    
+    Args:
+        context: 回调上下文
+        
+    Returns:
+        dict: 可直接修改的字段字典
+    """
+    return context.user_data.setdefault("submission", {})
+
+def reset_submission(context: CallbackContext):
+    """
+    开始新会话时重置暂存的投稿字段
+    
+    Args:
+        context: 回调上下文
+    """
+    context.user_data["submission"] = {}
+    context.user_data["submission_touched"] = time.time()
+
+async def get_session_mode(context: CallbackContext, user_id: int):
+    """
+    获取当前会话的投稿模式，优先读取内存缓存，缺失时查询数据库并写回缓存
+    
+    注意：会打开数据库连接，不能在 get_db() 上下文中调用
+    
+    Args:
+        context: 回调上下文
+        user_id: 用户ID
+        
+    Returns:
+        str: 投稿模式；会话记录不存在时返回 None
+    """
+    submission = get_submission(context)
+    mode = submission.get("mode")
+    if mode is None:
+        async with get_db() as conn:
+            async with conn.execute(SQL_SELECT_MODE, (user_id,)) as cursor:
+                row = await cursor.fetchone()
+        if not row:
+            return None
+        mode = (row["mode"] or "mixed").lower()
+        submission["mode"] = mode
+    return mode
+
+def clear_submission(context: CallbackContext):
+    """
+    会话结束时清除暂存的投稿字段
+    
+    Args:
+        context: 回调上下文
+    """
+    context.user_data.pop("submission", None)
+    context.user_data.pop("submission_touched", None)
+
 def validate_state(expected_state: int):
     """
     验证会话状态装饰器
@@ -219,29 +223,78 @@ def validate_state(expected_state: int):
         @wraps(func)
         async def wrapper(update: Update, context: CallbackContext):
             user_id = update.effective_user.id
-            try:
-                async with get_db() as conn:
-                    c = await conn.cursor()
-                    await c.execute("SELECT timestamp FROM submissions WHERE user_id=?", (user_id,))
-                    result = await c.fetchone()
-                    if not result:
-                        await update.message.reply_text("❌ 会话已过期，请重新发送 /start")
-                        return ConversationHandler.END
-            except Exception as e:
-                logger.error(f"状态验证错误: {e}")
-                await update.message.reply_text("❌ 内部错误，请稍后再试")
-                return ConversationHandler.END
+            now = time.time()
+            touched = context.user_data.get("submission_touched")
+            # 最近刚确认过会话有效时直接放行，否则刷新数据库中的时间戳并确认记录仍存在
+            if touched is None or now - touched >= SESSION_TOUCH_INTERVAL:
+                try:
+                    async with get_db() as conn:
+                        async with conn.execute(SQL_TOUCH_SUBMISSION, (now, user_id)) as cursor:
+                            alive = cursor.rowcount > 0
+                except Exception as e:
+                    logger.error(f"状态验证错误: {e}")
+                    await update.message.reply_text("❌ 内部错误，请稍后再试")
+                    return ConversationHandler.END
+                if not alive:
+                    clear_submission(context)
+                    await update.message.reply_text("❌ 会话已过期，请重新发送 /start")
+                    return ConversationHandler.END
+                context.user_data["submission_touched"] = now
             return await func(update, context)
         return wrapper
     return decorator
 
-async def safe_send(send_func, *args, **kwargs):
+# Telegram 限制机器人全局每秒约 30 条消息，留出一条余量
+SEND_RATE_PER_SECOND = 29
+
+class _TokenBucket:
     """
-    安全发送函数，包含重试逻辑
+    所有用户共享的令牌桶限速器
+    
+    未超过速率时直接放行，超过时按先来先到排队等待令牌，而不是触发 429 后再退避重试。
+    """
+    def __init__(self, rate, capacity):
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        # 首次 acquire 时才在事件循环中创建，Python 3.9 的 Lock 会绑定创建时的事件循环
+        self._lock = None
+
+    async def acquire(self, tokens=1):
+        """
+        取得指定数量的令牌，不足时等待
+        
+        Args:
+            tokens: 本次发送计入的消息条数，媒体组按其中的媒体数计算
+        """
+        tokens = min(tokens, self._capacity)
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self._tokens) / self._rate)
+
+send_limiter = _TokenBucket(rate=SEND_RATE_PER_SECOND, capacity=SEND_RATE_PER_SECOND)
+
+async def safe_send(send_func, *args, send_tokens=1, raise_errors=False, **kwargs):
+    """
+    安全发送函数，包含限速和重试逻辑
+    
+    每次尝试前都从全局限速器取得令牌；超时和网络错误按指数退避重试，触发限流时按
+    服务器要求的时间等待。包括等待在内，整个调用不超过 NET_TIMEOUT 秒。
     
     Args:
         send_func: 发送函数
         args: 位置参数
+        send_tokens: 本次发送计入全局限速的消息条数，媒体组按其中的媒体数计算
+        raise_errors: 为 True 时不可重试的错误（如 Forbidden、BadRequest）直接抛出
         kwargs: 关键字参数
         
     Returns:
@@ -249,29 +302,47 @@ async def safe_send(send_func, *args, **kwargs):
     """
     max_retries = 2  # 最多重试次数
     current_attempt = 0
-    last_error = None
+    # 整个调用的截止时间，每次尝试和重试前的等待都不能超过它
+    deadline = time.monotonic() + NET_TIMEOUT
     
-    while current_attempt <= max_retries:
+    while True:
+        await send_limiter.acquire(send_tokens)
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            logger.warning(f"发送失败: 已超过 {NET_TIMEOUT} 秒的截止时间")
+            return None
         try:
-            return await asyncio.wait_for(send_func(*args, **kwargs), timeout=NET_TIMEOUT)
-        except asyncio.TimeoutError:
+            return await asyncio.wait_for(send_func(*args, **kwargs), timeout=remaining)
+        except RetryAfter as e:
             current_attempt += 1
-            last_error = f"网络请求超时 (尝试 {current_attempt}/{max_retries + 1})"
-            # 只有在最后一次尝试失败时才记录
-            if current_attempt > max_retries:
-                logger.warning(last_error)
-            else:
-                # 非最后一次尝试，只打印调试信息
-                logger.debug(f"发送超时，正在重试 ({current_attempt}/{max_retries + 1})...")
-                await asyncio.sleep(2)  # 等待2秒后重试
+            last_error = f"触发 Telegram 限流，需等待 {e.retry_after} 秒"
+            # 按服务器给出的时间等待，加入少量抖动避免同时重试
+            delay = e.retry_after + random.uniform(0, 0.5)
+        except BadRequest as e:
+            # BadRequest 是 NetworkError 的子类，但请求本身有误，重试无济于事
+            if raise_errors:
+                raise
+            logger.error(f"发送失败: {e}")
+            return None
+        except (asyncio.TimeoutError, NetworkError) as e:
+            # PTB 的读写超时抛出 TimedOut（NetworkError 的子类），与 wait_for 超时一并重试
+            current_attempt += 1
+            last_error = f"网络错误: {e}" if str(e) else "网络请求超时"
+            # 指数退避（2、4秒，最多8秒）并加入随机抖动，避免多个请求同时重试
+            delay = min(2 ** current_attempt, 8) * random.uniform(0.75, 1.25)
         except Exception as e:
             # 其他错误直接记录
-            last_error = str(e)
+            if raise_errors:
+                raise
             logger.error(f"发送失败: {e}")
             return None
-    
-    # 所有重试都失败，但我们不想中断流程，所以返回 None
-    return None
+        
+        # 重试次数用尽，或等待后会超过截止时间时放弃；不想中断流程，所以返回 None
+        if current_attempt > max_retries or time.monotonic() + delay >= deadline:
+            logger.warning(f"{last_error}，放弃发送 (尝试 {current_attempt}/{max_retries + 1})")
+            return None
+        logger.debug(f"{last_error}，{delay:.1f} 秒后重试 ({current_attempt}/{max_retries + 1})...")
+        await asyncio.sleep(delay)
 
 # 增强型安全发送函数
 async def enhanced_safe_send(send_func, *args, **kwargs):
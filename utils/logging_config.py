@@ -2,20 +2,23 @@
 日志配置模块
 """
 import os
+import re
 import time
 import glob
 import logging
 from datetime import datetime, timedelta
 from logging.handlers import RotatingFileHandler
 
+# 超时关键词，忽略大小写一次匹配
+_TIMEOUT_PATTERN = re.compile(r"timeout|超时|timed out", re.IGNORECASE)
+
 class TimeoutMessageFilter(logging.Filter):
     """
     超时消息过滤器，将超时错误降级为警告
     """
     def filter(self, record):
-        # 如果是ERROR级别且消息中包含超时关键词
-        if record.levelno == logging.ERROR and any(kw in record.getMessage().lower() 
-                                                  for kw in ["timeout", "超时", "timed out"]):
+        # 非ERROR级别直接放行；ERROR级别只格式化一次消息，再检查是否包含超时关键词
+        if record.levelno == logging.ERROR and _TIMEOUT_PATTERN.search(record.getMessage()):
             # 将级别降为WARNING
             record.levelno = logging.WARNING
             record.levelname = "WARNING"